@@ -14,10 +14,10 @@ CREATE TABLE collectors
 );
 
 INSERT INTO collectors(collector_id, collector_description, collector_created)
-VALUES ('454577449', 'SAC Testing', '01/04/2024 09:29:00 AM'),
-       ('454577492', 'Dr Garrow Email', '01/04/2024 09:31:00 AM'),
-       ('454577519', 'Newsletters', '01/04/2024 09:33:00 AM'),
-       ('454577536', 'Other', '01/04/2024 09:34:00')
+VALUES ('454577449', 'SAC Testing', '2024-01-04 09:29:00'),
+       ('454577492', 'Dr Garrow Email', '2024-01-04 09:31:00'),
+       ('454577519', 'Newsletters', '2024-01-04 09:33:00'),
+       ('454577536', 'Other', '2024-01-04 09:34:00')
 ;
 
 
@@ -71,7 +71,7 @@ CREATE TABLE question_rank_responses
 (
     respondent_id  BIGINT  NOT NULL
         CONSTRAINT question_rank_responses_respondents_fk REFERENCES respondents (respondent_id),
-    question_id    INTEGER NOT NULL
+    question_id    SMALLINT NOT NULL
         CONSTRAINT question_rank_responses_question_fk REFERENCES questions (question_id),
     grammar        BOOLEAN NOT NULL,
     middle         BOOLEAN NOT NULL,
@@ -155,3 +155,46 @@ VALUES (1, 1, 'Each parent or guardian will submit a separate survey, and we wil
        (9, 2, 'Somewhat Welcoming'),
        (9, 1, 'Not Welcoming')
 ;
+
+
+-- Progress of a chunked ingest (INGEST_CHUNK_SIZE), so a failed load can resume where it left off.
+-- file_fingerprint is a hash of the file's contents; a different file at the same path starts over
+CREATE TABLE ingest_checkpoints
+(
+    input_filepath     TEXT NOT NULL
+        CONSTRAINT ingest_checkpoints_pk PRIMARY KEY,
+    last_respondent_id BIGINT,
+    rows_committed     INTEGER,
+    updated_at         TIMESTAMP,
+    file_fingerprint   TEXT
+);
+
+
+-- Weighted response counts for each breakout of the rank questions (see rank_cube.py).
+-- Rebuilt by 02_data_ingest.py after every load, and by 03_QA_Checks.sql after soft deletes.
+-- grouping_id has one bit per breakout column, from question_id (16) to first_year (1), set when the column is rolled up
+CREATE TABLE rank_response_aggregates
+(
+    question_id    SMALLINT,
+    level          TEXT,
+    any_support    BOOLEAN,
+    minority       BOOLEAN,
+    first_year     BOOLEAN,
+    soft_delete    BOOLEAN,
+    response_value SMALLINT,
+    grouping_id    SMALLINT NOT NULL,
+    num_responses  BIGINT
+);
+
+
+-- Bumped by every write to this schema (02_data_ingest.py, 03_QA_Checks.sql), so cached query results know when they're out of date.
+-- updated_at is part of the cache key too, so a rebuilt schema, which starts again from version 0, doesn't match the old results
+CREATE TABLE data_version
+(
+    version    INTEGER NOT NULL,
+    updated_at TIMESTAMP
+);
+
+INSERT INTO data_version(version, updated_at)
+VALUES (0, CURRENT_TIMESTAMP)
+;
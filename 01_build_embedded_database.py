@@ -0,0 +1,62 @@
+"""
+Build the tables from 01_build_database.sql in a local DuckDB file instead of on a Postgres server,
+so the whole pipeline can run in-process.  Point the .env file at the file to create, e.g.
+
+    DATABASE_CONNECTION_STRING=duckdb:///gvca_survey.duckdb
+
+The statements which only make sense on a server (creating the database and role) are skipped,
+and the tables are created in DATABASE_SCHEMA.  Rerunning is safe; existing tables are left alone.
+
+Foreign keys are left out.  DuckDB checks them against the state before the current transaction,
+so a respondent and their responses can't be deleted together, which incremental ingest depends on.
+"""
+import re
+from sqlalchemy import create_engine, inspect
+
+from utilities import EMBEDDED_DIALECTS, load_env_vars
+
+_, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
+
+# Server setup in 01_build_database.sql.  The schema is created from DATABASE_SCHEMA instead.
+SERVER_ONLY_STATEMENTS = ('CREATE DATABASE', 'SET ROLE', 'CREATE SCHEMA', 'SET SCHEMA')
+FOREIGN_KEY = re.compile(r'\s+CONSTRAINT \w+ REFERENCES \w+ \(\w+\)', flags=re.IGNORECASE)
+
+
+def main(sql_filepath='01_build_database.sql', database_schema=DATABASE_SCHEMA, database_connection_string=DATABASE_CONNECTION_STRING):
+    eng = create_engine(database_connection_string)
+    assert eng.dialect.name in EMBEDDED_DIALECTS, \
+        (f'{eng.dialect.name} is not an embedded database; run {sql_filepath} on the server instead. '
+         'DATABASE_CONNECTION_STRING should look like: duckdb:///gvca_survey.duckdb')
+
+    with open(sql_filepath, 'r') as f_in:
+        statements = split_sql_statements(f_in.read())
+
+    with eng.connect() as conn, conn.begin():
+        conn.execute(f'CREATE SCHEMA IF NOT EXISTS {database_schema};')
+        conn.execute(f"SET SCHEMA '{database_schema}';")
+        existing_tables = set(inspect(conn).get_table_names(schema=database_schema))
+
+        for statement in statements:
+            if statement.upper().startswith(SERVER_ONLY_STATEMENTS):
+                continue
+            # Skip tables which already exist, along with the rows which are inserted into them when they're created
+            tablename = re.match(r'(?:CREATE TABLE|INSERT INTO)\s+(\w+)', statement, flags=re.IGNORECASE)
+            if tablename and tablename.group(1) in existing_tables:
+                continue
+            conn.execute(FOREIGN_KEY.sub('', statement))
+
+    print(f'Built {database_schema} in {database_connection_string}')
+
+
+def split_sql_statements(sql: str) -> list:
+    """
+    Split a script into statements, on semicolons at the end of a line.  Comment lines are dropped.
+
+    :return: list of str, without the trailing semicolon
+    """
+    sql = '\n'.join(line for line in sql.splitlines() if not line.strip().startswith('--'))
+    return [statement.strip() for statement in re.split(r';\s*$', sql, flags=re.MULTILINE) if statement.strip()]
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,61 @@
 # TODO refactor this whole thing to be config based.  Given text[], standardized text output, indexes, etc.
 #      One major problem is that questions are defined separately in the database and the functions below.  If the text doesn't match exactly, there are silent errors.
 
+import inspect
+import json
 import logging
-from csv import reader as csv_reader
-from sqlalchemy import create_engine, text
-from utilities import load_env_vars
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from csv import DictReader, reader as csv_reader, writer as csv_writer
+from datetime import datetime
+from hashlib import sha256
+from io import StringIO
+from itertools import islice
+from time import perf_counter
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, create_engine, text
+from rank_cube import refresh_rank_aggregates
+from snapshots import write_snapshot
+from utilities import IngestMetrics, bump_data_version, get_cache_directory, load_env_vars, load_optional_env_flag, load_optional_env_var
 
 INPUT_FILEPATH, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
 
 
-def inspect_header(conn):
+def inspect_header(conn, input_filepath=INPUT_FILEPATH, database_schema=DATABASE_SCHEMA,
+                   raw_header=None, raw_sub_header=None, use_cache=True):
     """
     Run only to check out the file structure and figure out what is in each column.
     Fix known errors and validate.
     Return a list with info about each column in the survey data, aka "header information."
 
+    The result is cached on disk, keyed by the two header rows, the contents of the `questions` table, and the source of
+    fix_questions() and validate_fixed_questions(), so exports with the same layout skip fixing and validating.
+    Changing any of them, e.g. editing the fixes for a new year's survey, misses the cache.
+
+    :param conn: sqlalchemy connection
+    :param input_filepath: raw survey results csv
+    :param database_schema: schema holding the `questions` table
+    :param raw_header: first row of the file, if it has already been read
+    :param raw_sub_header: second row of the file, if it has already been read
+    :param use_cache: set to False to always fix and validate the header
     :return questions: dict(int: {'question description': str, 'question context': str, 'question type': str})
     """
     # get headers, organize columns
-    with open(INPUT_FILEPATH, 'r') as f_in:
-        raw_data_reader = csv_reader(f_in)
-        raw_header = raw_data_reader.__next__()
-        raw_sub_header = raw_data_reader.__next__()
+    if raw_header is None or raw_sub_header is None:
+        with open(input_filepath, 'r') as f_in:
+            raw_data_reader = csv_reader(f_in)
+            raw_header = raw_data_reader.__next__()
+            raw_sub_header = raw_data_reader.__next__()
+
+    question_info_from_db = conn.execute(f"""SELECT question_id, question_type, question_text FROM {database_schema}.questions ORDER BY question_id;""").fetchall()
+    header_signature = sha256(json.dumps([raw_header, raw_sub_header, [list(q) for q in question_info_from_db],
+                                          inspect.getsource(fix_questions), inspect.getsource(validate_fixed_questions)]).encode()).hexdigest()
+    cache_filepath = get_cache_directory('header') / f'{header_signature}.json'
+    if use_cache and cache_filepath.exists():
+        logging.info('Using cached header information from %s', cache_filepath)
+        with open(cache_filepath, 'r') as f_cache:
+            return {int(i): q for i, q in json.load(f_cache).items()}
 
     # fill empty columns with the appropriate question
     raw_questions = {}
@@ -35,18 +69,23 @@ def inspect_header(conn):
             'question context': (sub_question if sub_question else None),
         }
 
-    logging.info(raw_questions)
-    raw_questions = fix_questions(conn, raw_questions)
+    logging.info('Raw header information: %s', raw_questions)
+    raw_questions = fix_questions(conn, raw_questions, database_schema, question_info_from_db)
     validate_fixed_questions(raw_questions)
+
+    with open(cache_filepath, 'w') as f_cache:
+        json.dump(raw_questions, f_cache)
     return raw_questions
 
 
-def fix_questions(conn, questions):
+def fix_questions(conn, questions, database_schema=DATABASE_SCHEMA, question_info_from_db=None):
     """
     fix typos in questions, and add additional context where needed.
 
     :param conn: sqlalchemy connection
     :param questions: dict(int: {'question description': str, 'question context': str})
+    :param database_schema: schema holding the `questions` table
+    :param question_info_from_db: rows of (question_id, question_type, question_text), if they have already been queried
     :return questions:
     """
     # Typo with wrong type of apostrophe
@@ -90,7 +129,8 @@ def fix_questions(conn, questions):
             questions[i]['question context'] = "High School"
 
     # Add additional information to each header
-    question_info_from_db = conn.execute(f"""SELECT question_id, question_type, question_text FROM {DATABASE_SCHEMA}.questions;""").fetchall()
+    if question_info_from_db is None:
+        question_info_from_db = conn.execute(f"""SELECT question_id, question_type, question_text FROM {database_schema}.questions;""").fetchall()
 
     # Add in identifiers and types from the database
     for i, q in questions.items():
@@ -248,72 +288,610 @@ def validate_fixed_questions(questions):
                                                                        if text != questions[i]['question description']]) + '"')
 
 
-def get_question_response(questions: dict, question_description: str, response_row: dict) -> int:
+class PlannedColumn(NamedTuple):
+    """
+    Everything needed to turn one answered cell into a row in a "question_*_responses" table.
+    """
+    column_index: int
+    question_id: int
+    question_type: str
+    grammar: bool
+    middle: bool
+    high: bool
+    whole_school: bool
+
+
+def build_ingest_plan(questions: dict) -> dict:
+    """
+    Compile the header information into the list of columns which hold answers, so each row is parsed
+    in a single pass over only those columns instead of matching every question against every column.
+    Run once per file, after the header has been fixed and validated.
+
+    :param questions: header information from inspect_header()
+    :return plan: {'rank columns': [PlannedColumn],
+                   'open response columns': [PlannedColumn],
+                   'rank columns by level': {'Grammar School': [int], 'Middle School': [int], 'High School': [int]},
+                   'columns by question_id': {int: [int]}}
+    """
+    plan = {
+        'rank columns': [],
+        'open response columns': [],
+        'rank columns by level': {'Grammar School': [], 'Middle School': [], 'High School': []},
+        'columns by question_id': {},
+    }
+    for i, q in questions.items():
+        if q.get('question type') not in ('rank', 'open response'):
+            continue
+
+        column = PlannedColumn(
+            column_index=i,
+            question_id=q['question_id'],
+            question_type=q['question type'],
+            grammar=q['question context'] == 'Grammar School',
+            middle=q['question context'] == 'Middle School',
+            high=q['question context'] == 'High School',
+            whole_school=q['question context'] == 'Whole School',
+        )
+        plan['columns by question_id'].setdefault(column.question_id, []).append(i)
+        if column.question_type == 'rank':
+            plan['rank columns'].append(column)
+            if q['question context'] in plan['rank columns by level']:
+                plan['rank columns by level'][q['question context']].append(i)
+        else:
+            plan['open response columns'].append(column)
+
+    return plan
+
+
+def get_question_response(plan: dict, question_id: int, response_row: list) -> int:
     """
-    Iterate through all the columns which match the description.  Return the first of those columns which has been answered (should only be one).
+    Look through all the columns for the question.  Return the first of those columns which has been answered (should only be one).
 
-    :param questions: dictionary of all questions and their indexes
-    :param question_description: the text to match
+    :param plan: ingest plan from build_ingest_plan()
+    :param question_id: the question to find
     :param response_row: the row of responses we're searching through for a response to the question
     :return:
     """
-    for i in [question_index for question_index, question_values in questions.items() if question_values['question description'] == question_description]:
+    for i in plan['columns by question_id'].get(question_id, []):
         if response_row[i]:
             return convert_to_int(response_row[i])
 
 
-def main():
+def main(bulk_load=False, chunk_size=None, engine='rows', incremental=False,
+         input_filepath=INPUT_FILEPATH, database_schema=DATABASE_SCHEMA, database_connection_string=DATABASE_CONNECTION_STRING):
     """
     Insert rows of data into the database.  Tables must already exist.
+    Once the rows are written, rank_response_aggregates is rebuilt and the data version is bumped;
+    in the same transaction, unless loading in chunks.
 
-    :return:
+    :param bulk_load: buffer all rows and write each table at once (COPY on postgres), instead of one INSERT per row
+    :param chunk_size: if given, commit every `chunk_size` rows and resume from the last commit when rerun.  See ingest_in_chunks()
+    :param engine: how the file is parsed.
+        'rows' parses one row at a time with the populate_* functions.
+        'vectorized' parses the whole file at once with build_response_frames(), then bulk loads it.  Can't be combined with chunk_size.
+        'compare' runs both without writing anything, and prints any rows where they disagree.
+    :param incremental: only load respondents which are new, or have changed since they were loaded; see respondent_status()
+    :param input_filepath: raw survey results csv
+    :param database_schema: schema to write into
+    :param database_connection_string: SQLAlchemy connection string
+    :return summary: {'rows': number of rows (respondents) loaded from the file,
+                      'metrics': IngestMetrics.summary(), with time spent in each stage and rows/statements per table}
     """
-    eng = create_engine(DATABASE_CONNECTION_STRING)
-    with open(INPUT_FILEPATH, 'r') as f_in, eng.connect() as conn:
+    assert engine in ('rows', 'vectorized', 'compare'), f"Unknown INGEST_ENGINE {engine!r}; use 'rows', 'vectorized', or 'compare'"
+    assert not (chunk_size and engine == 'vectorized'), \
+        'INGEST_CHUNK_SIZE loads the file row by row, so it can\'t be combined with INGEST_ENGINE=vectorized; unset one of them'
+
+    metrics = IngestMetrics()
+    eng = create_engine(database_connection_string)
+    with open(input_filepath, 'r') as f_in, eng.connect() as conn:
         raw_data_reader = csv_reader(f_in)
 
-        raw_questions = inspect_header(conn)
-        # since the questions have been fixed, skip reading those here
-        header = raw_data_reader.__next__()
-        sub_header = raw_data_reader.__next__()
+        # read the header once, and hand it to inspect_header() instead of having it open the file again
+        with metrics.time('header'):
+            header = raw_data_reader.__next__()
+            sub_header = raw_data_reader.__next__()
+            raw_questions = inspect_header(conn, input_filepath, database_schema, header, sub_header)
+            plan = build_ingest_plan(raw_questions)
+
+        if engine == 'compare':
+            differences_by_table = compare_ingest_paths(conn, plan, raw_data_reader, input_filepath, database_schema)
+            for tablename, differences in differences_by_table.items():
+                print(f'{tablename}: {len(differences)} rows differ')
+                if len(differences) > 0:
+                    print(differences.to_string())
+            return {'rows': 0}
+
+        # Without `incremental`, every respondent is treated as new
+        loaded_respondents = load_respondent_versions(conn, database_schema) if incremental else {}
 
-        # database setup
-        conn.execute('BEGIN TRANSACTION;')
-        conn.execute(f"SET SCHEMA '{DATABASE_SCHEMA}';")
-        logging.info(f'Writing to schema: {DATABASE_SCHEMA}')
+        if chunk_size:
+            rows_committed = ingest_in_chunks(conn, plan, raw_data_reader, chunk_size, bulk_load,
+                                              input_filepath, database_schema, loaded_respondents, metrics)
+            # The file is fully loaded, so a rerun (e.g. of a new export saved to the same path) starts from the top
+            with metrics.time('aggregates'), conn.begin():
+                refresh_rank_aggregates(conn, database_schema)
+                bump_data_version(conn, database_schema)
+                delete_checkpoint(conn, input_filepath)
+            metrics.print_summary()
+            return {'rows': rows_committed, 'metrics': metrics.summary()}
+
+        # database setup.  The transaction is managed by sqlalchemy, so it works the same way on embedded databases
+        transaction = conn.begin()
+        conn.execute(f"SET SCHEMA '{database_schema}';")
+        logging.info('Writing to schema: %s', database_schema)
+
+        if engine == 'vectorized':
+            row_buffer = RowBuffer(metrics=metrics)
+            with metrics.time('decode'):
+                frames = build_response_frames(conn, plan, input_filepath, database_schema, loaded_respondents)
+                for tablename, frame in frames.items():
+                    row_buffer.add_frame(tablename, frame)
+            metrics.row_done(len(frames['respondents']))
+            with metrics.time('db write'):
+                delete_respondents(conn, [respondent_id for respondent_id in frames['respondents'].respondent_id
+                                          if respondent_id in loaded_respondents])
+                rows_written = row_buffer.flush(conn)
+                with metrics.time('aggregates'):
+                    refresh_rank_aggregates(conn, database_schema)
+                    bump_data_version(conn, database_schema)
+                transaction.commit()
+            metrics.print_summary()
+            return {'rows': rows_written.get('respondents', 0), 'metrics': metrics.summary()}
+
+        # In bulk mode, rows are collected here and written after the whole file has been parsed
+        row_buffer = RowBuffer(metrics=metrics) if bulk_load else None
+        writer = row_buffer.add_to_table if bulk_load else timed_add_to_table(metrics)
 
         # each row represents one respondent's answers to every question.
         # Parse each row into separate tables
-        for i, row in enumerate(raw_data_reader):
-            logging.info(f'Processing row {i}')
+        with metrics.time('decode'):
+            for row in raw_data_reader:
+                metrics.row_done()
+                status = respondent_status(row, loaded_respondents)
+                metrics.count(f'respondents.{status}')
+                if status == 'unchanged':
+                    continue
+                if status == 'changed':
+                    with metrics.time('db write'):
+                        delete_respondents(conn, [row[0]])
+
+                # Includes questions 1, 2, 12, 13, 14, and meta information
+                populate_respondents(conn, plan, row, writer)
+                populate_rank_response(conn, plan, row, writer)
+                populate_open_response(conn, plan, row, writer)
+
+        with metrics.time('db write'):
+            if bulk_load:
+                row_buffer.flush(conn)
+            with metrics.time('aggregates'):
+                refresh_rank_aggregates(conn, database_schema)
+                bump_data_version(conn, database_schema)
+            transaction.commit()
+
+    metrics.print_summary()
+    return {'rows': metrics.counters['respondents.new'] + metrics.counters['respondents.changed'], 'metrics': metrics.summary()}
+
+
+def load_respondent_versions(conn, database_schema=DATABASE_SCHEMA) -> dict:
+    """
+    Find who has already been loaded, and which version of their response.
+
+    :return: dict(respondent_id as it appears in the file: end_datetime) for every respondent in the schema
+    """
+    return {str(respondent_id): end_datetime
+            for respondent_id, end_datetime
+            in conn.execute(f"""SELECT respondent_id, end_datetime FROM {database_schema}.respondents;""")}
+
+
+def respondent_status(row: list, loaded_respondents: dict) -> str:
+    """
+    Survey Monkey updates the End Date whenever a respondent edits their response,
+    so a respondent which is already loaded with the same End Date doesn't need to be parsed again.
+
+    :param row: row of the survey file
+    :param loaded_respondents: from load_respondent_versions()
+    :return: 'new', 'changed', or 'unchanged'
+    """
+    if row[0] not in loaded_respondents:
+        return 'new'
+    if parse_survey_timestamp(row[3]) == loaded_respondents[row[0]]:
+        return 'unchanged'
+    return 'changed'
+
+
+def parse_survey_timestamp(value: str):
+    """
+    Parse a Survey Monkey date, like "01/04/2024 09:29:00 AM".
+    Postgres understands these as they are, but embedded databases don't, so they're always parsed before being written.
+
+    :return: datetime, or None if the value isn't in a known format
+    """
+    for timestamp_format in ['%m/%d/%Y %I:%M:%S %p', '%m/%d/%Y %H:%M:%S']:
+        try:
+            return datetime.strptime(value, timestamp_format)
+        except ValueError:
+            continue
+    return None
+
+
+def delete_respondents(conn, respondent_ids: list) -> None:
+    """
+    Remove respondents and all of their responses, so a changed response can be loaded again from scratch.
+
+    :param conn: connection to database, with the schema already set
+    :param respondent_ids: respondent_id values as they appear in the file
+    :return: None
+    """
+    if not respondent_ids:
+        return
+
+    for tablename in ['question_rank_responses', 'question_open_responses', 'respondents']:
+        conn.execute(
+            text(f'DELETE FROM {tablename} WHERE respondent_id IN :respondent_ids').bindparams(bindparam('respondent_ids', expanding=True)),
+            {'respondent_ids': [int(respondent_id) for respondent_id in respondent_ids]}
+        )
+
+
+def ingest_manifest(manifest_filepath: str, max_workers: int = None, **ingest_options) -> list:
+    """
+    Load several survey files at once, e.g. to rebuild every prior year.
+    Each file is parsed and loaded by main() in its own process, with its own database connection.
 
-            # Includes questions 1, 2, 12, 13, 14, and meta information
-            populate_respondents(conn, raw_questions, row)
+    The manifest is a csv with a header row and two columns: `input_filepath,database_schema`.
+    Every file must use the column layout expected by fix_questions(); for older layouts, rerun that year's release.
 
-            # iterate through all questions.  Check the question type, then insert data into the correct place
-            for question_id, question_type, question_text in conn.execute(f"""SELECT question_id, question_type, question_text FROM {DATABASE_SCHEMA}.questions;""").all():
-                logging.info(f'Processing question {question_id} for row {i}')
-                if question_type == 'rank':
-                    populate_rank_response(conn, question_id, question_text, raw_questions, row)
-                if question_type == 'open response':
-                    populate_open_response(conn, question_id, question_text, raw_questions, row)
+    :param manifest_filepath: csv listing the files to load and the schema for each
+    :param max_workers: number of processes; defaults to one per CPU
+    :param ingest_options: passed through to main(), e.g. bulk_load=True
+    :return summaries: one dict per file, in the order they finished
+    """
+    with open(manifest_filepath, 'r') as f_in:
+        manifest = [(row['input_filepath'], row['database_schema']) for row in DictReader(f_in)]
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(ingest_file, input_filepath, database_schema, **ingest_options)
+                   for input_filepath, database_schema in manifest]
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            print(f"{summary['database_schema']} <- {summary['input_filepath']}: " +
+                  (f"{summary['rows']} rows in {summary['seconds']:.1f}s" if summary['error'] is None else
+                   f"FAILED after {summary['seconds']:.1f}s: {summary['error']}"))
+
+    return summaries
+
+
+def ingest_file(input_filepath: str, database_schema: str, **ingest_options) -> dict:
+    """
+    Run main() for one file, and summarize how it went.  Runs in a worker process for ingest_manifest().
 
-        conn.execute('END TRANSACTION;')
+    :return summary: {'input_filepath': str, 'database_schema': str, 'rows': int, 'seconds': float, 'error': str or None}
+    """
+    start_time = perf_counter()
+    summary = {'input_filepath': input_filepath, 'database_schema': database_schema, 'rows': 0, 'error': None}
+    try:
+        summary.update(main(input_filepath=input_filepath, database_schema=database_schema, **ingest_options))
+    except Exception as e:
+        # Report the failure alongside the other files, rather than abandoning the whole batch
+        summary['error'] = repr(e)
+
+    summary['seconds'] = perf_counter() - start_time
+    return summary
+
+
+def ingest_in_chunks(conn, plan, raw_data_reader, chunk_size: int, bulk_load=False,
+                     input_filepath=INPUT_FILEPATH, database_schema=DATABASE_SCHEMA, loaded_respondents=None,
+                     metrics=None) -> int:
+    """
+    Stream the file into the database `chunk_size` rows at a time, committing each chunk in its own transaction.
+    The last committed respondent is saved in `ingest_checkpoints` as part of the same transaction,
+    so a rerun after a failure picks up right after the last chunk which made it into the database.
+    Only one chunk is held in memory at a time, and locks are only held for the duration of a chunk.
 
+    Checkpoints are kept for the file's path and a hash of its contents, and main() deletes the checkpoint once the whole
+    file is loaded.  A different export saved to the same path, e.g. one corrected after a failed run, is read from the top,
+    skipping respondents which are already loaded and reloading ones which have changed, like `incremental` in main().
+    To reload a file from scratch after a failure, delete its row from `ingest_checkpoints` along with the survey data.
 
-def populate_respondents(conn, questions, row):
+    :param conn: connection to database
+    :param plan: ingest plan from build_ingest_plan()
+    :param raw_data_reader: csv reader positioned at the first row of answers (after the two header rows)
+    :param chunk_size: number of rows per transaction
+    :param bulk_load: write each chunk with RowBuffer instead of one INSERT per row
+    :param input_filepath: raw survey results csv; identifies the checkpoint, along with file_fingerprint()
+    :param database_schema: schema to write into
+    :param loaded_respondents: from load_respondent_versions(), to only load new or changed respondents
+    :param metrics: IngestMetrics to record progress in; a new one is used if not given
+    :return rows_committed: number of rows of the file which are now in the database, including previous runs
+    """
+    metrics = metrics or IngestMetrics()
+    conn.execute(f"SET SCHEMA '{database_schema}';")
+    logging.info('Writing to schema: %s', database_schema)
+    create_checkpoint_table(conn)
+    fingerprint = file_fingerprint(input_filepath)
+
+    # Skip past everything which was committed by a previous run of the same file
+    rows_committed = 0
+    checkpoint = conn.execute(
+        text('SELECT last_respondent_id, rows_committed, file_fingerprint FROM ingest_checkpoints WHERE input_filepath = :input_filepath'),
+        {'input_filepath': input_filepath}
+    ).first()
+    if checkpoint and checkpoint.file_fingerprint != fingerprint:
+        logging.warning('%s has changed since its checkpoint was saved (%s rows committed); '
+                        'reading it from the top, and only loading new or changed respondents', input_filepath, checkpoint.rows_committed)
+        # The previous run's rows are still committed, so loading them again would duplicate them
+        loaded_respondents = load_respondent_versions(conn, database_schema)
+    elif checkpoint:
+        last_respondent_id, rows_committed, _ = checkpoint
+        # consume the committed rows without keeping them, and check the last one is the respondent we expect
+        last_skipped_row = next(islice(raw_data_reader, rows_committed - 1, rows_committed), None)
+        assert last_skipped_row and last_skipped_row[0] == str(last_respondent_id), \
+            (f'The checkpoint for {input_filepath} says row {rows_committed} was respondent {last_respondent_id}, '
+             'but the file does not match.  Delete the checkpoint and the survey data to reload the file.')
+        logging.info('Resuming after respondent %s (%s rows already committed)', last_respondent_id, rows_committed)
+
+    while True:
+        with metrics.time('decode'):
+            chunk = list(islice(raw_data_reader, chunk_size))
+        if not chunk:
+            break
+
+        # Use a transaction managed by sqlalchemy, so none of the chunk's statements are committed on their own.
+        # Time spent committing is counted as 'db write'.
+        with metrics.time('db write'), conn.begin():
+            row_buffer = RowBuffer(metrics=metrics) if bulk_load else None
+            writer = row_buffer.add_to_table if bulk_load else timed_add_to_table(metrics)
+            with metrics.time('decode'):
+                for row in chunk:
+                    metrics.row_done()
+                    status = respondent_status(row, loaded_respondents or {})
+                    metrics.count(f'respondents.{status}')
+                    if status == 'unchanged':
+                        continue
+                    if status == 'changed':
+                        with metrics.time('db write'):
+                            delete_respondents(conn, [row[0]])
+
+                    populate_respondents(conn, plan, row, writer)
+                    populate_rank_response(conn, plan, row, writer)
+                    populate_open_response(conn, plan, row, writer)
+            if bulk_load:
+                row_buffer.flush(conn)
+
+            rows_committed += len(chunk)
+            # Each chunk changes the data, in case the load stops before main() bumps it at the end
+            bump_data_version(conn, database_schema)
+            save_checkpoint(conn, input_filepath, fingerprint, last_respondent_id=chunk[-1][0], rows_committed=rows_committed)
+
+        logging.debug('Committed %s rows', rows_committed)
+
+    return rows_committed
+
+
+def create_checkpoint_table(conn) -> None:
+    """
+    Schemas built before checkpoints were introduced don't have the table yet; see 01_build_database.sql
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints
+        (
+            input_filepath     TEXT NOT NULL
+                CONSTRAINT ingest_checkpoints_pk PRIMARY KEY,
+            last_respondent_id BIGINT,
+            rows_committed     INTEGER,
+            updated_at         TIMESTAMP,
+            file_fingerprint   TEXT
+        );
+        """)
+    # Tables created before checkpoints were tied to the file's contents
+    conn.execute('ALTER TABLE ingest_checkpoints ADD COLUMN IF NOT EXISTS file_fingerprint TEXT;')
+
+
+def file_fingerprint(input_filepath: str) -> str:
+    """
+    :return: sha256 of the file's contents, so a checkpoint is only used for the file it was saved for
+    """
+    file_hash = sha256()
+    with open(input_filepath, 'rb') as f_in:
+        for block in iter(lambda: f_in.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def save_checkpoint(conn, input_filepath: str, fingerprint: str, last_respondent_id: str, rows_committed: int) -> None:
+    """
+    Record how far into the file the database has been loaded.
+    Call inside the same transaction as the rows it describes.
+
+    :param fingerprint: from file_fingerprint()
+    """
+    conn.execute(
+        text("""
+            INSERT INTO ingest_checkpoints (input_filepath, last_respondent_id, rows_committed, updated_at, file_fingerprint)
+            VALUES (:input_filepath, :last_respondent_id, :rows_committed, CURRENT_TIMESTAMP, :file_fingerprint)
+            ON CONFLICT (input_filepath) DO UPDATE
+                SET last_respondent_id = excluded.last_respondent_id,
+                    rows_committed     = excluded.rows_committed,
+                    updated_at         = excluded.updated_at,
+                    file_fingerprint   = excluded.file_fingerprint
+            """),
+        {'input_filepath': input_filepath, 'last_respondent_id': last_respondent_id, 'rows_committed': rows_committed,
+         'file_fingerprint': fingerprint}
+    )
+
+
+def delete_checkpoint(conn, input_filepath: str) -> None:
+    """
+    Forget a file's progress once it's completely loaded.
+    """
+    conn.execute(text('DELETE FROM ingest_checkpoints WHERE input_filepath = :input_filepath'), {'input_filepath': input_filepath})
+
+
+def build_response_frames(conn, plan: dict, input_filepath=INPUT_FILEPATH, database_schema=DATABASE_SCHEMA,
+                          loaded_respondents=None) -> dict:
+    """
+    Vectorized alternative to the populate_* functions.
+    Load the whole file into a DataFrame, melt the answered cells into long form, and decode each distinct answer once
+    using the `question_response_mapping` table.  Averages for each respondent are grouped sums over the long form.
+
+    :param conn: connection to database
+    :param plan: ingest plan from build_ingest_plan()
+    :param input_filepath: raw survey results csv
+    :param database_schema: schema holding the `question_response_mapping` table
+    :param loaded_respondents: from load_respondent_versions(); respondents which are already loaded and unchanged are left out
+    :return frames: dict(tablename: DataFrame), with the same rows and columns the populate_* functions write
+    """
+    raw = pd.read_csv(input_filepath, header=None, skiprows=2, dtype=str, keep_default_na=False)
+    if loaded_respondents:
+        # Same rule as respondent_status(), one comparison per distinct End Date
+        end_datetimes = raw[3].map({end_datetime: parse_survey_timestamp(end_datetime) for end_datetime in raw[3].unique()})
+        unchanged = raw[0].isin(list(loaded_respondents)) & (end_datetimes == raw[0].map(loaded_respondents))
+        raw = raw[~unchanged].reset_index(drop=True)
+    num_rows = len(raw)
+    respondent_ids = raw[0].to_numpy()
+    timestamps = {value: parse_survey_timestamp(value) for value in pd.unique(raw[[2, 3]].to_numpy().ravel())}
+
+    # Rank responses: decode each (question, answer text) pair through the mapping table.
+    # Anything the mapping doesn't know about falls back to convert_to_int(), so the results match the row-by-row path.
+    rank = melt_answers(raw, plan['rank columns'])
+    response_mapping = pd.read_sql(
+        sql=f"""SELECT question_id, response_value, response_text FROM {database_schema}.question_response_mapping;""",
+        con=conn
+    )
+    validate_response_mapping(response_mapping[response_mapping.question_id.isin(rank.question_id.unique())])
+    rank = rank.merge(response_mapping, how='left',
+                      left_on=['question_id', 'response'], right_on=['question_id', 'response_text'])
+    unmapped = rank.response_value.isna()
+    rank.loc[unmapped, 'response_value'] = rank.loc[unmapped, 'response'].map(
+        {response: convert_to_int(response) for response in rank.loc[unmapped, 'response'].unique()})
+    rank['response_value'] = rank.response_value.astype(int)
+    rank = rank.sort_values(['row_number', 'column_index'], ignore_index=True)
+
+    open_response = melt_answers(raw, plan['open response columns'])
+
+    def average_by_row(mask: np.ndarray) -> np.ndarray:
+        totals = np.bincount(rank.row_number[mask], weights=rank.response_value[mask], minlength=num_rows)
+        counts = np.bincount(rank.row_number[mask], minlength=num_rows)
+        return np.divide(totals, counts, out=np.full(num_rows, np.nan), where=counts > 0)
+
+    respondents = pd.DataFrame({
+        'respondent_id': respondent_ids,
+        'collector_id': raw[1],
+        'start_datetime': raw[2].map(timestamps),
+        'end_datetime': raw[3].map(timestamps),
+        'num_individuals_in_response': raw[9].map({
+            'Each parent or guardian will submit a separate survey, and we will submit two surveys.': 1,
+            'All parents and guardians will coordinate responses, and we will submit only one survey.': 2,
+        }).astype('Int64'),
+        'tenure': raw[133].map({tenure: int(tenure) if tenure else None for tenure in raw[133].unique()}).astype('Int64'),
+        'minority': raw[135].map({'Yes': True, 'No': False}),
+        'any_support': raw[134].map({'Yes': True, 'No': False}),
+        'grammar_avg': average_by_row(rank.grammar.to_numpy()),
+        'middle_avg': average_by_row(rank.middle.to_numpy()),
+        'high_avg': average_by_row(rank.high.to_numpy()),
+        'overall_avg': average_by_row(rank.grammar.to_numpy() | rank.middle.to_numpy() | rank.high.to_numpy()),
+    })
+
+    return {
+        'respondents': respondents,
+        'question_rank_responses': pd.DataFrame({
+            'respondent_id': respondent_ids[rank.row_number],
+            'question_id': rank.question_id,
+            'grammar': rank.grammar,
+            'middle': rank.middle,
+            'high': rank.high,
+            'response_value': rank.response_value,
+        }),
+        'question_open_responses': pd.DataFrame({
+            'respondent_id': respondent_ids[open_response.row_number],
+            'question_id': open_response.question_id,
+            'grammar': open_response.grammar,
+            'middle': open_response.middle,
+            'high': open_response.high,
+            'whole_school': open_response.whole_school,
+            'response': open_response.response,
+        }),
+    }
+
+
+def melt_answers(raw: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """
+    Long form of the answered cells: one row per (row of the file, column with an answer), in file order.
+
+    :param raw: the survey file, without the header rows
+    :param columns: list of PlannedColumn to include
+    :return: DataFrame with `row_number`, every PlannedColumn field, and `response`
+    """
+    values = raw[[column.column_index for column in columns]].to_numpy()
+    row_numbers, positions = np.nonzero(values != '')
+
+    answers = pd.DataFrame(columns, columns=PlannedColumn._fields).iloc[positions].reset_index(drop=True)
+    answers.insert(0, 'row_number', row_numbers)
+    answers['response'] = values[row_numbers, positions]
+    return answers
+
+
+def validate_response_mapping(response_mapping: pd.DataFrame) -> None:
+    """
+    The mapping table and convert_to_int() must agree, otherwise the vectorized and row-by-row paths write different values.
+
+    :param response_mapping: rows of `question_response_mapping` for the rank questions
+    :return: None
+    """
+    disagreements = response_mapping[response_mapping.response_text.map(convert_to_int) != response_mapping.response_value]
+    assert disagreements.empty, \
+        ('question_response_mapping disagrees with convert_to_int():\n\t' +
+         '\n\t'.join(f'question {q}: "{t}" is {v} in the database' for q, v, t in disagreements.itertuples(index=False, name=None)))
+
+
+def compare_ingest_paths(conn, plan: dict, raw_data_reader, input_filepath=INPUT_FILEPATH, database_schema=DATABASE_SCHEMA) -> dict:
+    """
+    Parse the file with both the row-by-row path and the vectorized path, without writing to the database.
+
+    :param conn: connection to database
+    :param plan: ingest plan from build_ingest_plan()
+    :param raw_data_reader: csv reader positioned at the first row of answers (after the two header rows)
+    :param input_filepath: raw survey results csv, the same file `raw_data_reader` is reading
+    :param database_schema: schema holding the `question_response_mapping` table
+    :return differences: dict(tablename: DataFrame of rows produced by only one path; `only_in` says which)
+    """
+    row_buffer = RowBuffer()
+    for row in raw_data_reader:
+        populate_respondents(conn, plan, row, row_buffer.add_to_table)
+        populate_rank_response(conn, plan, row, row_buffer.add_to_table)
+        populate_open_response(conn, plan, row, row_buffer.add_to_table)
+
+    def comparable(frame: pd.DataFrame) -> pd.DataFrame:
+        # Compare values as text, so e.g. None/NaN/<NA> and int/numpy.int64 don't register as differences
+        return frame.astype(object).where(frame.notna(), None).applymap(str)
+
+    differences = {}
+    for tablename, vectorized_frame in build_response_frames(conn, plan, input_filepath, database_schema).items():
+        row_frame = pd.DataFrame(row_buffer.rows.get(tablename, []), columns=vectorized_frame.columns, dtype=object)
+        merged = comparable(row_frame).merge(comparable(vectorized_frame), how='outer', indicator=True)
+        differences[tablename] = (merged[merged._merge != 'both']
+                                  .assign(only_in=lambda df: df._merge.astype(str).map({'left_only': 'rows', 'right_only': 'vectorized'}))
+                                  .drop(columns='_merge'))
+
+    return differences
+
+
+def populate_respondents(conn, plan, row, writer=None):
     # Create the respondent, including demographic information
-    grammar_rank_questions = [convert_to_int(row[i]) for i, q in questions.items() if q['question context'] == 'Grammar School' and row[i] and q['question type'] == 'rank']
-    middle_rank_questions = [convert_to_int(row[i]) for i, q in questions.items() if q['question context'] == 'Middle School' and row[i] and q['question type'] == 'rank']
-    high_rank_questions = [convert_to_int(row[i]) for i, q in questions.items() if q['question context'] == 'High School' and row[i] and q['question type'] == 'rank']
+    writer = writer or add_to_table
+    rank_columns_by_level = plan['rank columns by level']
+    grammar_rank_questions = [convert_to_int(row[i]) for i in rank_columns_by_level['Grammar School'] if row[i]]
+    middle_rank_questions = [convert_to_int(row[i]) for i in rank_columns_by_level['Middle School'] if row[i]]
+    high_rank_questions = [convert_to_int(row[i]) for i in rank_columns_by_level['High School'] if row[i]]
     all_rank_questions = grammar_rank_questions + middle_rank_questions + high_rank_questions
-    add_to_table(
+    writer(
         conn,
         tablename='respondents',
         respondent_id=row[0],
         collector_id=row[1],
-        start_datetime=row[2],
-        end_datetime=row[3],
+        start_datetime=parse_survey_timestamp(row[2]),
+        end_datetime=parse_survey_timestamp(row[3]),
         num_individuals_in_response=(1 if row[9] == 'Each parent or guardian will submit a separate survey, and we will submit two surveys.' else
                                      2 if row[9] == 'All parents and guardians will coordinate responses, and we will submit only one survey.' else
                                      None),
@@ -331,45 +909,58 @@ def populate_respondents(conn, questions, row):
     )
 
 
-def populate_rank_response(conn, question_id, question_text, raw_questions, row):
-    # Iterate through the columns of responses.  If it matches the question and has a response, insert it into the db
-    for question, response in zip(raw_questions.values(), row):
-        logging.debug(f'question_id: {question_id}')
-        logging.debug(f'question_text: {question_text}')
-        if question['question description'] == question_text and response:
-            logging.debug(f'{question["question context"]} response: {response}')
-            add_to_table(
+def populate_rank_response(conn, plan, row, writer=None):
+    # Iterate through the columns of rank responses.  If it has a response, insert it into the db
+    writer = writer or add_to_table
+    for column in plan['rank columns']:
+        response = row[column.column_index]
+        if response:
+            writer(
                 conn,
                 tablename='question_rank_responses',
                 respondent_id=row[0],
-                question_id=question_id,
-                grammar=question['question context'] == 'Grammar School',
-                middle=question['question context'] == 'Middle School',
-                high=question['question context'] == 'High School',
+                question_id=column.question_id,
+                grammar=column.grammar,
+                middle=column.middle,
+                high=column.high,
                 response_value=convert_to_int(response)
             )
 
-            
-def populate_open_response(conn, question_id, question_text, raw_questions, row):
-    # Iterate through the columns of responses.  If it matches the question and has a response, insert it into the db
-    for question, response in zip(raw_questions.values(), row):
-        logging.debug(f'question_id: {question_id}')
-        logging.debug(f'question_text: {question_text}')
-        if question['question description'] == question_text and response:
-            logging.debug(f'{question["question context"]} response: {response}')
-            add_to_table(
+
+def populate_open_response(conn, plan, row, writer=None):
+    # Iterate through the columns of open responses.  If it has a response, insert it into the db
+    writer = writer or add_to_table
+    for column in plan['open response columns']:
+        response = row[column.column_index]
+        if response:
+            writer(
                 conn,
                 tablename='question_open_responses',
                 respondent_id=row[0],
-                question_id=question_id,
-                grammar=question['question context'] == 'Grammar School',
-                middle=question['question context'] == 'Middle School',
-                high=question['question context'] == 'High School',
-                whole_school=question['question context'] == 'Whole School',
+                question_id=column.question_id,
+                grammar=column.grammar,
+                middle=column.middle,
+                high=column.high,
+                whole_school=column.whole_school,
                 response=response
             )
 
 
+def timed_add_to_table(metrics):
+    """
+    add_to_table(), recording the time spent and the rows and statements sent for each table.
+
+    :param metrics: IngestMetrics
+    :return: function with the same signature as add_to_table()
+    """
+    def writer(conn, tablename: str, **kwargs) -> None:
+        with metrics.time('db write'):
+            add_to_table(conn, tablename, **kwargs)
+        metrics.count(f'rows written.{tablename}')
+        metrics.count(f'statements.{tablename}')
+    return writer
+
+
 def add_to_table(conn, tablename: str, **kwargs) -> None:
     """
     Insert values into table.
@@ -388,6 +979,118 @@ def add_to_table(conn, tablename: str, **kwargs) -> None:
     conn.execute(query, {**{'tablename': tablename}, **kwargs})
 
 
+class RowBuffer:
+    """
+    Collect rows in memory, then write each table in one bulk operation instead of one INSERT per row.
+    `RowBuffer().add_to_table` has the same signature as add_to_table(), so it can be handed to the populate_* functions.
+    """
+
+    def __init__(self, batch_size: int = 1000, metrics=None):
+        """
+        :param batch_size: number of rows per executemany() call, for databases which don't support COPY
+        :param metrics: IngestMetrics, to count the rows and statements flush() sends for each table
+        """
+        self.batch_size = batch_size
+        self.metrics = metrics
+        self.rows = {}
+
+    def add_to_table(self, conn, tablename: str, **kwargs) -> None:
+        """
+        Buffer a row for the table.  Nothing is sent to the database until flush() is called.
+        """
+        self.rows.setdefault(tablename, []).append(kwargs)
+
+    def add_frame(self, tablename: str, frame: pd.DataFrame) -> None:
+        """
+        Buffer every row of a DataFrame for the table.  Missing values are written as NULL.
+        """
+        self.rows.setdefault(tablename, []).extend(frame.astype(object).where(frame.notna(), None).to_dict('records'))
+
+    def flush(self, conn) -> dict:
+        """
+        Write every buffered row, then empty the buffer.
+        Tables are written in the order they were first seen, so respondents are written before the responses that reference them.
+
+        :param conn: connection to database
+        :return rows_written: dict(tablename: number of rows written)
+        """
+        rows_written = {}
+        for tablename, rows in self.rows.items():
+            if not rows:
+                continue
+            if conn.dialect.name == 'postgresql':
+                copy_to_table(conn, tablename, rows)
+                num_statements = 1
+            elif conn.dialect.name == 'duckdb':
+                append_to_duckdb_table(conn, tablename, rows)
+                num_statements = 1
+            else:
+                for i in range(0, len(rows), self.batch_size):
+                    executemany_to_table(conn, tablename, rows[i:i + self.batch_size])
+                num_statements = -(-len(rows) // self.batch_size)
+            rows_written[tablename] = len(rows)
+            if self.metrics:
+                self.metrics.count(f'rows written.{tablename}', len(rows))
+                self.metrics.count(f'statements.{tablename}', num_statements)
+
+        self.rows = {}
+        return rows_written
+
+
+def copy_to_table(conn, tablename: str, rows: list) -> None:
+    """
+    Stream rows into a postgres table with COPY FROM STDIN.  Every row must have the same keys.
+    Uses the connection's own DBAPI cursor, so the COPY is part of the current transaction.
+
+    :param conn: connection to a postgres database
+    :param tablename: name of the table into which the values will be inserted
+    :param rows: list of dicts; values are inserted into a column with the same name as the key
+    :return: None
+    """
+    keys = list(rows[0].keys())
+    csv_buffer = StringIO()
+    # None is written as an unquoted empty field, which COPY reads as NULL
+    csv_writer(csv_buffer).writerows([row[k] for k in keys] for row in rows)
+    csv_buffer.seek(0)
+
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {tablename} ({", ".join(keys)}) FROM STDIN WITH (FORMAT csv)', csv_buffer)
+
+
+def append_to_duckdb_table(conn, tablename: str, rows: list) -> None:
+    """
+    Insert rows into a DuckDB table in one statement, by scanning them as a DataFrame.  Every row must have the same keys.
+    Uses the connection's own DBAPI connection, so the insert is part of the current transaction.
+
+    :param conn: connection to a DuckDB database
+    :param tablename: name of the table into which the values will be inserted
+    :param rows: list of dicts; values are inserted into a column with the same name as the key
+    :return: None
+    """
+    keys = list(rows[0].keys())
+    duckdb_connection = conn.connection.connection
+    duckdb_connection.register('rows_to_append', pd.DataFrame(rows, columns=keys))
+    try:
+        duckdb_connection.execute(f'INSERT INTO {tablename} ({", ".join(keys)}) SELECT {", ".join(keys)} FROM rows_to_append')
+    finally:
+        duckdb_connection.unregister('rows_to_append')
+
+
+def executemany_to_table(conn, tablename: str, rows: list) -> None:
+    """
+    Insert many rows with a single multi-row statement.  Every row must have the same keys.
+
+    :param conn: connection to database
+    :param tablename: name of the table into which the values will be inserted
+    :param rows: list of dicts; values are inserted into a column with the same name as the key
+    :return: None
+    """
+    keys = rows[0].keys()
+    query = text(f'INSERT INTO {tablename} ({", ".join(list(keys))}) '
+                 f'VALUES ({", ".join([":" + k for k in keys])})')
+    conn.execute(query, rows)
+
+
 def convert_to_bool(value):
     return True if value == 'Yes' else False if value == 'No' else None
 
@@ -405,4 +1108,23 @@ def convert_to_int(value):
 
 
 if __name__ == '__main__':
-    main()
+    options = {
+        'bulk_load': load_optional_env_flag('INGEST_BULK_LOAD'),
+        'chunk_size': int(load_optional_env_var('INGEST_CHUNK_SIZE', 0)),
+        'engine': load_optional_env_var('INGEST_ENGINE', 'rows'),
+        'incremental': load_optional_env_flag('INGEST_INCREMENTAL'),
+    }
+    if load_optional_env_var('INGEST_MANIFEST'):
+        summaries = ingest_manifest(load_optional_env_var('INGEST_MANIFEST'),
+                                    max_workers=int(load_optional_env_var('INGEST_MAX_WORKERS', 0)) or None,
+                                    **options)
+        loaded_schemas = [summary['database_schema'] for summary in summaries if summary['error'] is None]
+    else:
+        main(**options)
+        loaded_schemas = [DATABASE_SCHEMA]
+
+    if load_optional_env_flag('INGEST_SNAPSHOT'):
+        # Keep a columnar copy of each schema, so analysis can run without the database; see snapshots.py
+        with create_engine(DATABASE_CONNECTION_STRING).connect() as connection:
+            for loaded_schema in loaded_schemas:
+                write_snapshot(connection, loaded_schema)
@@ -20,6 +20,56 @@ WHERE responses_by_respondents.respondent_id = respondents.respondent_id
   AND NOT has_rank_response
 ;
 
+-- Rebuild the weighted counts used by the charts, now that soft deletes have changed.  Same as rank_cube.refresh_rank_aggregates()
+CREATE TABLE IF NOT EXISTS rank_response_aggregates
+(
+    question_id    SMALLINT,
+    level          TEXT,
+    any_support    BOOLEAN,
+    minority       BOOLEAN,
+    first_year     BOOLEAN,
+    soft_delete    BOOLEAN,
+    response_value SMALLINT,
+    grouping_id    SMALLINT NOT NULL,
+    num_responses  BIGINT
+);
+
+DELETE FROM rank_response_aggregates;
+INSERT INTO rank_response_aggregates (question_id, level, any_support, minority, first_year, soft_delete, response_value, grouping_id, num_responses)
+WITH rank_rows AS
+         (
+             SELECT question_id,
+                    CASE
+                        WHEN grammar THEN 'Grammar'
+                        WHEN middle THEN 'Middle'
+                        WHEN high THEN 'High'
+                        END    AS level,
+                    any_support,
+                    minority,
+                    tenure = 1 AS first_year,
+                    soft_delete,
+                    response_value,
+                    num_individuals_in_response
+             FROM question_rank_responses
+                      JOIN
+                  respondents USING (respondent_id)
+         )
+SELECT question_id, level, any_support, minority, first_year,
+       soft_delete,
+       response_value,
+       GROUPING(question_id, level, any_support, minority, first_year) AS grouping_id,
+       CAST(SUM(num_individuals_in_response) AS BIGINT)                AS num_responses
+FROM rank_rows
+GROUP BY soft_delete, response_value,
+         GROUPING SETS ((), (level), (question_id), (question_id, level), (question_id, any_support), (question_id, minority), (question_id, first_year))
+;
+
+-- Cached chart queries from before the soft deletes are out of date
+UPDATE data_version
+SET version    = version + 1,
+    updated_at = CURRENT_TIMESTAMP
+;
+
 -- Look at those who didn't do any ranked choice, but did do open response.  What were their responses?
 SELECT respondent_id,
        ROUND(EXTRACT(EPOCH FROM end_datetime - start_datetime) / 60, 1) AS minutes_elapsed,
@@ -78,30 +78,24 @@ ORDER BY question_id, response_value
 
 
 -- What % of responses are Satisfied or Very Satisfied (weighted by # individuals)?
-SELECT ROUND(100. * SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 ) /
-             SUM(family.num_individuals_in_response), 1)                           AS overall,
+-- Reads the weighted counts by grade level in rank_response_aggregates (grouping_id 23) instead of every response
+SELECT ROUND(100. * SUM(num_responses) FILTER ( WHERE response_value >= 3 ) /
+             SUM(num_responses), 1)                                                   AS overall,
 
-       ROUND(100. * SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 AND q.grammar) /
-             SUM(family.num_individuals_in_response) FILTER ( WHERE q.grammar), 1) AS grammar,
+       ROUND(100. * SUM(num_responses) FILTER ( WHERE response_value >= 3 AND level = 'Grammar') /
+             SUM(num_responses) FILTER ( WHERE level = 'Grammar'), 1)                 AS grammar,
 
-       ROUND(100. * SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 AND q.middle) /
-             SUM(family.num_individuals_in_response) FILTER ( WHERE q.middle ), 1) AS middle,
+       ROUND(100. * SUM(num_responses) FILTER ( WHERE response_value >= 3 AND level = 'Middle') /
+             SUM(num_responses) FILTER ( WHERE level = 'Middle' ), 1)                 AS middle,
 
-       ROUND(100. * SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 AND q.high) /
-             SUM(family.num_individuals_in_response) FILTER ( WHERE q.high ), 1)   AS high,
+       ROUND(100. * SUM(num_responses) FILTER ( WHERE response_value >= 3 AND level = 'High') /
+             SUM(num_responses) FILTER ( WHERE level = 'High' ), 1)                   AS high,
 
-       ROUND(100. * (
-                       SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 AND q.middle) +
-                       SUM(family.num_individuals_in_response) FILTER ( WHERE q.response_value >= 3 AND q.high)
-           ) / (
-                             SUM(family.num_individuals_in_response) FILTER ( WHERE q.middle) +
-                             SUM(family.num_individuals_in_response) FILTER ( WHERE q.high)
-                 ), 1)                                                             AS upper
-FROM respondents AS family
-         JOIN
-     question_rank_responses AS q USING (respondent_id)
-WHERE NOT soft_delete
-  AND overall_avg IS NOT NULL
+       ROUND(100. * SUM(num_responses) FILTER ( WHERE response_value >= 3 AND level IN ('Middle', 'High')) /
+             SUM(num_responses) FILTER ( WHERE level IN ('Middle', 'High')), 1)       AS upper
+FROM rank_response_aggregates
+WHERE grouping_id = 23 -- grouped by level
+  AND NOT soft_delete
 ;
 
 -- What % of parents/guardians had an average score of 3 or above, broken out by grammar/middle/high.
@@ -150,11 +144,10 @@ FROM satisfaction_per_group
 WITH responses AS
          (
              SELECT response_value,
-                    SUM(num_individuals_in_response) AS num_responses
-             FROM question_rank_responses
-                      JOIN
-                  respondents USING (respondent_id)
-             WHERE NOT soft_delete
+                    SUM(num_responses) AS num_responses
+             FROM rank_response_aggregates
+             WHERE grouping_id = 31 -- every response together
+               AND NOT soft_delete
              GROUP BY response_value
              ORDER BY response_value DESC
          ),
@@ -1,275 +1,301 @@
+import logging
+import os
+
+import matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from sqlalchemy import create_engine
-from sqlalchemy.engine.base import Engine as sqlalchemy_Engine
+from typing import NamedTuple
 
-from utilities import load_env_vars
+from breakout_engine import BreakoutEngine
+from confidence_intervals import bootstrap_breakout, draw_resamples
+from rank_cube import RankCube, chart_inputs
+from significance import screen
+from snapshots import snapshot_engine
+from utilities import (ArtifactCache, cached_read_sql, get_engine, load_env_vars, load_optional_env_flag, load_optional_env_var,
+                       run_concurrently)
+from year_over_year import comparable_schemas, discover_survey_schemas, yoy_queries
 
 _, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
 
+LEVELS = {'Grammar': 'Grammar', 'Middle': 'Middle', 'High': 'High'}
+SUPPORT = {True: 'Received Support', False: 'Did not Receive Support', None: 'Did not answer'}
+MINORITY = {True: 'Minority', False: 'Not Minority', None: 'Did not answer'}
+FIRST_YEAR = {True: 'First Year Family', False: 'Returning Family', None: 'Did not answer'}
+
+# Categories of each breakout chart, by the RankCube dimension it breaks out
+BREAKOUT_CATEGORIES = {'level': LEVELS, 'any_support': SUPPORT, 'minority': MINORITY, 'first_year': FIRST_YEAR}
+
+# Each process started by render_charts() costs about a second (starting Python, importing matplotlib) against about 0.15s
+# to draw a chart, so a process only pays for itself with a few seconds of drawing.  36 charts took as long from 4 processes as from one.
+MIN_CHARTS_PER_PROCESS = 50
+
+# Legend label and color of each response value's segment of the stacked bars.
+# Charts of other categories can pass their own; see draw_stacked_bar_chart()
+RESPONSE_STYLES = {
+    4: {'label': 'Very', 'color': '#6caf40'},
+    3: {'label': 'Satisfied', 'color': '#4080af'},
+    2: {'label': 'Somewhat', 'color': '#f6c100'},
+    1: {'label': 'Not', 'color': '#ae3f3f'},
+}
 
-def query_to_bar_chart(conn: sqlalchemy_Engine,
-                       title: str,
-                       x_axis_label: str,
-                       x_data_label_query: str,
-                       proportion_query: str,
-                       subfolder: Path = None
-                       ) -> None:
+
+class ChartSpec(NamedTuple):
+    """
+    Everything create_stacked_bar_chart() needs to draw one chart, so charts can be gathered first and rendered later.
+    """
+    title: str
+    x_axis_label: str
+    x_data_labels: list
+    proportions: pd.DataFrame
+    subfolder: Path = None
+    styles: dict = RESPONSE_STYLES
+
+
+def chart_spec(title: str,
+               x_axis_label: str,
+               counts: pd.DataFrame,
+               subfolder: Path = None,
+               intervals: pd.DataFrame = None
+               ) -> ChartSpec:
     """
-    Execute two queries and modify results to feed the creation of a stacked bar chart.
-    :param conn:
+    Describe a stacked bar chart of a slice of the RankCube, with one bar for each row of `counts`.
     :param title:
     :param x_axis_label:
-    :param x_data_label_query:
-    :param proportion_query:
+    :param counts: from RankCube.counts(); each bar is labelled with its row's label and average score
     :param subfolder:
+    :param intervals: confidence intervals of the average scores, to add to the labels; see rank_cube.chart_inputs()
     :return:
     """
+    x_data_labels, proportions = chart_inputs(counts, intervals)
+    return ChartSpec(title=title, x_axis_label=x_axis_label, x_data_labels=x_data_labels,
+                     proportions=proportions, subfolder=subfolder)
 
-    x_data_labels = pd.read_sql(con=conn, sql=x_data_label_query).title.tolist()
-    proportions = pd.read_sql(con=conn, sql=proportion_query)
 
-    create_stacked_bar_chart(title=title, x_axis_label=x_axis_label, x_data_labels=x_data_labels,
-                             proportions=proportions, subfolder=subfolder)
+def chart_filepath(spec: ChartSpec) -> Path:
+    return (spec.subfolder or Path('artifacts')) / f'{spec.title}.png'
 
 
-def create_stacked_bar_chart(title: str, x_axis_label: str, x_data_labels: list, proportions: pd.DataFrame, subfolder: Path = None) -> None:
+def chart_cache_inputs(spec: ChartSpec) -> dict:
+    """
+    Everything which changes how a chart looks, for ArtifactCache.
+    """
+    return {'title': spec.title, 'x_axis_label': spec.x_axis_label, 'x_data_labels': spec.x_data_labels,
+            'proportions': spec.proportions.to_dict('list'),
+            'style': spec.styles, 'matplotlib': matplotlib.__version__}
+
+
+def render_charts(chart_specs: list, processes: int = 0, headless=False, force_rebuild=False) -> None:
+    """
+    Draw and save every chart.
+    Charts drawn before from the same data are copied from the ArtifactCache instead, and aren't shown.
+
+    :param chart_specs: list of ChartSpec
+    :param processes: save the charts from up to this many processes at once, each with its own HeadlessChartRenderer:
+        no more than there are CPUs, and only one for every MIN_CHARTS_PER_PROCESS charts to draw.
+        With fewer than two, or 0, they're all drawn in this process, headless.
+    :param headless: when drawing in this process, save the charts without showing them
+    :param force_rebuild: draw every chart, even if it's unchanged
+    :return: None
+    """
+    cache = ArtifactCache(force_rebuild=force_rebuild)
+    chart_specs = [spec for spec in chart_specs if not cache.restore(chart_filepath(spec), chart_cache_inputs(spec))]
+
+    num_processes = min(processes, os.cpu_count() or 1, len(chart_specs) // MIN_CHARTS_PER_PROCESS)
+    if num_processes > 1:
+        with ProcessPoolExecutor(max_workers=num_processes) as pool:
+            # One batch per process, so each process only sets up its figure once
+            list(pool.map(render_headless, [chart_specs[i::num_processes] for i in range(num_processes)]))
+    elif headless or processes:
+        render_headless(chart_specs)
+    else:
+        for spec in chart_specs:
+            create_stacked_bar_chart(**spec._asdict())
+
+    for spec in chart_specs:
+        cache.store(chart_filepath(spec), chart_cache_inputs(spec))
+    cache.print_summary('Rank question charts')
+
+
+def render_headless(chart_specs: list) -> None:
     """
-    Save a stacked bar chart to ./artifacts/
+    Save each chart without showing it, reusing one figure.
+    """
+    with HeadlessChartRenderer() as renderer:
+        for spec in chart_specs:
+            renderer.render(spec)
+
+
+class HeadlessChartRenderer:
+    """
+    Saves charts without a GUI, by drawing every chart on the same Figure, which is cleared in between.
+    The Figure is drawn by the Agg canvas directly rather than through pyplot, so it never opens a window,
+    and pyplot doesn't keep a reference to it.  Memory stays flat however many charts are rendered.
+
+        with HeadlessChartRenderer() as renderer:
+            renderer.render(chart_spec)
+    """
+
+    def __init__(self):
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+
+    def render(self, spec: ChartSpec) -> None:
+        self.ax.clear()
+        draw_stacked_bar_chart(self.ax, spec.title, spec.x_axis_label, spec.x_data_labels, spec.proportions, spec.styles)
+        self.figure.tight_layout()
+        self.figure.savefig(chart_filepath(spec), transparent=True)
+
+    def close(self) -> None:
+        self.figure.clear()
+        self.figure = self.ax = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def create_stacked_bar_chart(title: str, x_axis_label: str, x_data_labels: list, proportions: pd.DataFrame, subfolder: Path = None,
+                             styles: dict = RESPONSE_STYLES) -> None:
+    """
+    Save a stacked bar chart to ./artifacts/, and show it
 
     :param x_axis_label:
     :param title:
     :param x_data_labels:
-    :param proportions: {bottom_color_in_each_bar: [col1, col2, col3...],
-                         second_from_bottom_color_in_each_bar: [col1, col2, col3...], ...}
+    :param proportions: one row per bar and one column per category, e.g. from rank_cube.chart_inputs().
+        Columns are stacked from the bottom up.
     :param subfolder: Optional, otherwise use the title
+    :param styles: dict(category: keyword arguments for ax.bar(), e.g. label and color)
     :return:
     """
-    r1 = proportions[proportions.response_value == 1].pct.values.tolist()[0]
-    r2 = proportions[proportions.response_value == 2].pct.values.tolist()[0]
-    r3 = proportions[proportions.response_value == 3].pct.values.tolist()[0]
-    r4 = proportions[proportions.response_value == 4].pct.values.tolist()[0]
-
     fig, ax = plt.subplots()
-    ax.bar(x_data_labels, r4, label='Very', color='#6caf40', bottom=[q1 + q2 + q3 for q1, q2, q3 in zip(r1, r2, r3)])
-    ax.bar(x_data_labels, r3, label='Satisfied', color='#4080af', bottom=[q1 + q2 for q1, q2 in zip(r1, r2)])
-    ax.bar(x_data_labels, r2, label='Somewhat', color='#f6c100', bottom=r1)
-    ax.bar(x_data_labels, r1, label='Not', color='#ae3f3f')
+    draw_stacked_bar_chart(ax, title, x_axis_label, x_data_labels, proportions, styles)
+
+    plt.tight_layout()
+    plt.savefig((subfolder or Path('artifacts')) / f'{title}.png', transparent=True)
+    plt.show()
+    plt.close(fig)
+
+
+def draw_stacked_bar_chart(ax, title: str, x_axis_label: str, x_data_labels: list, proportions: pd.DataFrame,
+                           styles: dict = RESPONSE_STYLES) -> None:
+    """
+    Draw a stacked bar chart on `ax`, with any number of bars and categories.  See create_stacked_bar_chart() for the parameters.
+    Categories without a style are labelled with their name, in matplotlib's default colors.
+    """
+    heights = proportions.to_numpy(dtype=float)
+    # Each segment starts where the ones below it end
+    bottoms = np.cumsum(heights, axis=1) - heights
+
+    # One call per category draws its segment of every bar.  The top category goes first, so it's first in the legend
+    for i in reversed(range(heights.shape[1])):
+        category = proportions.columns[i]
+        ax.bar(x_data_labels, heights[:, i], bottom=bottoms[:, i], **styles.get(category, {'label': str(category)}))
 
     ax.set_title(title)
-    ax.legend(loc="upper center", ncol=4)
+    ax.legend(loc="upper center", ncol=min(heights.shape[1], 4))
     ax.set_xlabel(x_axis_label)
     ax.set_ylabel("Proportion")
 
-    plt.tight_layout()
-    plt.savefig(subfolder / title if subfolder else f'artifacts/{title}', transparent=True)
-    plt.show()
-
 
-def create_question_summary(conn):
-    query_to_bar_chart(
-        conn=conn,
+def create_question_summary(cube: RankCube):
+    # Questions are ordered as text, with the total at the end
+    question_ids = sorted(cube.question_ids(), key=str)
+    return chart_spec(
         title="Response Breakdown by Question",
         x_axis_label="Question ID\n(avg score)",
-        x_data_label_query="""
-            WITH question_avg_score AS
-                     (
-                         SELECT question_id::TEXT,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                         GROUP BY question_id
-            
-                     UNION ALL
-            
-                         SELECT 'Total'                                                                                                 AS question_id,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-            
-                         ORDER BY question_id
-                     )
-            SELECT CONCAT(question_id, E'\n',
-                          '(', avg_score, ')'
-                       ) AS title
-            FROM question_avg_score
-            """,
-        proportion_query="""
-            WITH question_response_counts AS
-                     (
-                         SELECT question_id::TEXT,
-                                response_value,
-                                SUM(num_individuals_in_response) AS num_responses
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                         GROUP BY question_id, response_value
-            
-                         UNION ALL
-            
-                         SELECT 'Total'                          AS question_id,
-                                response_value,
-                                SUM(num_individuals_in_response) AS num_responses
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                         GROUP BY response_value
-                     ),
-                 question_totals AS
-                     (
-                         SELECT question_id,
-                                SUM(num_responses) AS total
-                         FROM question_response_counts
-                         GROUP BY question_id
-                     )
-            SELECT response_value,
-                   ARRAY_AGG(num_responses::NUMERIC / total ORDER BY question_id) AS pct
-            FROM question_response_counts
-                     JOIN
-                 question_totals USING (question_id)
-            GROUP BY response_value
-            """
+        counts=pd.concat([
+            cube.counts(by='question_id', categories={question_id: str(question_id) for question_id in question_ids},
+                        include_soft_deleted=False),
+            cube.counts(include_soft_deleted=False),
+        ])
     )
 
 
-def create_grade_summary(conn):
-    query_to_bar_chart(
-        conn=conn,
+def create_grade_summary(cube: RankCube):
+    return chart_spec(
         title="Response Breakdown by Grade Level",
         x_axis_label="Grade Level\n(avg score)",
-        x_data_label_query="""
-            WITH question_avg_score AS
-                 (
-                     SELECT 'Grammar'                                                                                               AS question_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score,
-                            1                                                                                                       AS order_id
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND grammar
-        
-                     UNION ALL
-                     SELECT 'Middle'                                                                                               AS question_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score,
-                            2                                                                                                       AS order_id
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND middle
-        
-                     UNION ALL
-                     SELECT 'High'                                                                                               AS question_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score,
-                            3                                                                                                       AS order_id
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND high
-       
-                     UNION ALL
-                     SELECT 'Total'                                                                                                 AS question_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score,
-                            4                                                                                                       AS order_id
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                 )
-            SELECT CONCAT(question_id, E'\n',
-                          '(', avg_score, ')'
-                       ) AS title
-            FROM question_avg_score
-            ORDER BY order_id
-            """,
-        proportion_query="""
-            WITH level_response_counts AS
-                 (
-                     SELECT 'Grammar'                        AS level_name,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses,
-                            1                                AS level_order
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete AND grammar
-                     GROUP BY response_value
-        
-                     UNION ALL
-                     SELECT 'Middle'                         AS level_name,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses,
-                            2                                AS level_order
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete AND middle
-                     GROUP BY response_value
-        
-                     UNION ALL
-                     SELECT 'High'                           AS level_name,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses,
-                            3                                AS level_order
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete AND high
-                     GROUP BY response_value
-        
-                     UNION ALL
-        
-                     SELECT 'Total'                          AS level_name,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses,
-                            4                                AS level_order
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                     GROUP BY response_value
-                 ),
-             level_totals AS
-                 (
-                     SELECT level_name,
-                            SUM(num_responses) AS total
-                     FROM level_response_counts
-                     GROUP BY level_name
-                 )
-        SELECT response_value,
-               ARRAY_AGG(num_responses::NUMERIC / total 
-                         ORDER BY level_order) AS pct,
-               ARRAY_AGG(level_name
-                         ORDER BY level_order) AS level_names
-        FROM level_response_counts
-                 JOIN
-             level_totals USING (level_name)
-        GROUP BY response_value
-        ;
-        """
+        counts=pd.concat([
+            cube.counts(by='level', categories=LEVELS, include_soft_deleted=False),
+            cube.counts(include_soft_deleted=False),
+        ])
     )
 
 
-def breakout_by_question(conn):
-    # iterate over each question
-    questions = pd.read_sql_query(
-        sql="""
+def load_rank_questions(conn, database_schema=DATABASE_SCHEMA) -> pd.DataFrame:
+    return cached_read_sql(
+        sql=f"""
             SELECT question_id,
                    question_text
-            FROM questions
+            FROM {database_schema}.questions
             WHERE question_type = 'rank'
             """,
-        con=conn
+        conn=conn,
+        database_schema=database_schema
     )
+
+
+def load_chart_data(eng, max_workers: int = None, yoy=False, breakout_engine=False) -> dict:
+    """
+    Run every query the charts need at the same time, each on its own connection,
+    so loading takes about as long as the slowest query.
+
+    :param eng: sqlalchemy Engine
+    :param max_workers: number of queries to run at once; defaults to all of them
+    :param yoy: also load every year compared by the year over year charts
+    :param breakout_engine: also load the responses into a BreakoutEngine, for confidence intervals
+    :return: {'cube': RankCube for DATABASE_SCHEMA,
+              'questions': from load_rank_questions(),
+              'yoy_cubes': dict(year label: RankCube) for each year compared by the year over year charts; empty unless yoy,
+              'engine': BreakoutEngine for DATABASE_SCHEMA, or None}
+    """
+    years = {}
+    if yoy:
+        with eng.connect() as conn:
+            database_schemas = comparable_schemas(conn, yoy_schemas() or discover_survey_schemas(conn))
+        # YOY_REFRESH_CACHE rereads prior years which are cached in .cache/yoy/
+        years = yoy_queries(database_schemas, refresh_cache=load_optional_env_flag('YOY_REFRESH_CACHE'))
+
+    results = run_concurrently(eng, {
+        'cube': lambda conn: RankCube.load(conn, DATABASE_SCHEMA),
+        'questions': load_rank_questions,
+        # One query for each year
+        **{('yoy', year): query for year, query in years.items()},
+        **({'engine': lambda conn: BreakoutEngine.load(conn, DATABASE_SCHEMA)} if breakout_engine else {}),
+    }, max_workers)
+    return {'cube': results['cube'], 'questions': results['questions'],
+            'yoy_cubes': {year: results[('yoy', year)] for year in years}, 'engine': results.get('engine')}
+
+
+def breakout_by_question(cube: RankCube, questions: pd.DataFrame, yoy_cubes: dict, engine: BreakoutEngine = None,
+                         only: set = None) -> list:
+    """
+    :param cube: RankCube for the current year
+    :param questions: from load_rank_questions()
+    :param yoy_cubes: from year_over_year.load_yoy_cubes()
+    :param engine: BreakoutEngine for the current year.  If given, the breakout charts show a 95% confidence interval
+        under each average score
+    :param only: set of (question_id, dimension) to chart, e.g. the significant rows of screen_breakouts(); defaults to all of them.
+        Dimensions are those of BREAKOUT_CATEGORIES, and 'year' for the year over year charts
+    :return: list of ChartSpec, five for each question
+    """
+    chart_specs = []
+
+    # Intervals for every question at once, for each breakout
+    resamples = draw_resamples(engine, seed=0) if engine else None
+    intervals = {dimension: bootstrap_breakout(engine, 'question_id', dimension, resamples=resamples)['average'] if engine else None
+                 for dimension in ['level', 'any_support', 'minority', 'first_year']}
+
+    # iterate over each question
     for (question_id, question_text) in questions.itertuples(index=False, name=None):
         summarized_text = question_text
         if question_id == 3:
@@ -285,623 +311,239 @@ def breakout_by_question(conn):
         elif question_id == 8:
             summarized_text = "Communication with school leadership"
 
-        by_grade_level(conn, question_id, summarized_text)
-        by_support_summary(conn, question_id, summarized_text)
-        by_minority_summary(conn, question_id, summarized_text)
-        by_first_year_family_summary(conn, question_id, summarized_text)
-        yoy_question_diff(conn, question_id, summarized_text)
+        charts = {
+            'level': lambda: by_grade_level(cube, question_id, summarized_text, question_intervals(intervals['level'], question_id)),
+            'any_support': lambda: by_support_summary(cube, question_id, summarized_text, question_intervals(intervals['any_support'], question_id)),
+            'minority': lambda: by_minority_summary(cube, question_id, summarized_text, question_intervals(intervals['minority'], question_id)),
+            'first_year': lambda: by_first_year_family_summary(cube, question_id, summarized_text,
+                                                               question_intervals(intervals['first_year'], question_id)),
+            'year': lambda: yoy_question_diff(yoy_cubes, question_id, summarized_text),
+        }
+        chart_specs += [chart() for dimension, chart in charts.items() if only is None or (question_id, dimension) in only]
+
+    return chart_specs
+
+
+def screen_breakouts(cube: RankCube, questions: pd.DataFrame, yoy_cubes: dict, fdr: float = 0.05) -> pd.DataFrame:
+    """
+    Test which of the breakout_by_question() charts show groups which really differ; see significance.screen().
+    Respondents who didn't answer a demographic question aren't a group of their own, so they're left out of its test.
+
+    :param fdr: false discovery rate
+    :return: from significance.screen(), one row per (question, breakout), with the question text
+    """
+    tables = {}
+    for question_id in questions.question_id:
+        for dimension, categories in BREAKOUT_CATEGORIES.items():
+            counts = cube.counts(by=dimension, categories=categories, question_id=question_id)
+            tables[(question_id, dimension)] = counts.drop(index='Did not answer', errors='ignore')
+        if len(yoy_cubes) > 1:
+            tables[(question_id, 'year')] = yoy_question_counts(yoy_cubes, question_id)
+
+    return questions.merge(screen(tables, fdr), on='question_id', how='right')
 
 
-def by_grade_level(conn, question_id, summarized_text):
+def question_intervals(intervals: pd.DataFrame, question_id) -> pd.DataFrame:
+    """
+    :param intervals: from bootstrap_breakout() by question_id and one other dimension, or None
+    :return: the rows for one question, indexed by the other dimension
+    """
+    return intervals.loc[question_id] if intervals is not None else None
+
+
+def by_grade_level(cube: RankCube, question_id, summarized_text, intervals: pd.DataFrame = None):
     """
     Given a question_id, create a chart breaking out each grade into its own column
     """
     subfolder = Path('artifacts/Rank Response - Grade Level')
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return chart_spec(
         title=f'{question_id}: ' + summarized_text,
         subfolder=subfolder,
         x_axis_label='Grade Level',
-        x_data_label_query=f"""
-            SELECT CASE WHEN grammar THEN 'Grammar'
-                        WHEN middle THEN 'Middle'
-                        WHEN high THEN 'High'
-                        END || 
-                        E'\n(' ||
-                        ROUND(
-                            SUM(response_value * num_individuals_in_response)::NUMERIC /
-                                SUM(num_individuals_in_response),
-                            2) || 
-                        ')' AS title
-            FROM question_rank_responses
-                     JOIN
-                 respondents USING (respondent_id)
-            WHERE question_id = {question_id}
-            GROUP BY grammar, middle, high
-            ORDER BY grammar DESC, middle DESC, high DESC
-                """,
-        proportion_query=f"""
-            WITH expected_values AS
-                     (
-                         SELECT levels.column1          AS level,
-                                levels.column2          AS level_order,
-                                response_values.column1 AS response_value
-                         FROM (VALUES ('Grammar', 1), ('Middle', 2), ('High', 3)) AS levels,
-                              (VALUES (1), (2), (3), (4)) AS response_values
-                     ),
-                 sum_by_grade AS
-                     (
-                         SELECT CASE
-                                    WHEN grammar THEN 'Grammar'
-                                    WHEN middle THEN 'Middle'
-                                    WHEN high THEN 'High'
-                                    END                          AS level,
-                                response_value,
-                                SUM(num_individuals_in_response) AS num_responses
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE question_id = {question_id}
-                         GROUP BY level, response_value
-                     ),
-                 fill_in_blanks AS
-                     (
-                         -- If a level doesn't have any responses, fill it in as 0
-                         SELECT level,
-                                level_order,
-                                response_value,
-                                COALESCE(num_responses, 0) AS num_responses
-                         FROM expected_values
-                                  LEFT JOIN
-                              sum_by_grade USING (level, response_value)
-                     ),
-                 sum_w_totals AS
-                     (
-                         SELECT level,
-                                SUM(num_responses) AS total
-                         FROM fill_in_blanks
-                         GROUP BY level
-                     )
-            SELECT response_value,
-                   ARRAY_AGG(num_responses::NUMERIC / total ORDER BY level_order) AS pct
-            FROM fill_in_blanks
-                     JOIN
-                 sum_w_totals USING (level)
-            GROUP BY response_value
-            ;"""
+        counts=cube.counts(by='level', categories=LEVELS, question_id=question_id),
+        intervals=intervals
     )
 
 
-def by_support_summary(conn, question_id, summarized_text):
+def by_support_summary(cube: RankCube, question_id, summarized_text, intervals: pd.DataFrame = None):
     """
     Given a question_id, create a chart breaking out students who received support services from those who did not
     """
     subfolder = Path('artifacts/Rank Response - Student Services')
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return chart_spec(
         title=f'{question_id}: ' + summarized_text,
         subfolder=subfolder,
         x_axis_label='Grade Level',
-        x_data_label_query=f"""
-            SELECT CASE
-                       WHEN respondents.any_support THEN 'Received Support'
-                       WHEN NOT any_support THEN 'Did not Receive Support'
-                       ELSE 'Did not answer'
-                       END ||
-                   E'\n(' ||
-                   ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                            SUM(num_individuals_in_response),
-                         2) ||
-                   ')' AS title
-            FROM question_rank_responses
-                     JOIN
-                 respondents USING (respondent_id)
-            WHERE question_id = {question_id}
-            GROUP BY any_support
-            ORDER BY any_support DESC NULLS LAST
-                """,
-        proportion_query=f"""
-            WITH expected_values AS
-                     (
-                         SELECT demographics.column1    AS demographic,
-                                demographics.column2    AS demographic_order, -- any_support desc nulls last
-                                response_values.column1 AS response_value
-                         FROM (VALUES ('Received Support', 1),
-                                      ('Did not Receive Support', 2),
-                                      ('Did not answer', 3)) AS demographics,
-                              (VALUES (1), (2), (3), (4)) AS response_values
-                     ),
-                 sum_by_demographic AS
-                     (
-                         SELECT CASE
-                                    WHEN any_support THEN 'Received Support'
-                                    WHEN NOT any_support THEN 'Did not Receive Support'
-                                    ELSE 'Did not answer'
-                                    END                          AS demographic,
-                                response_value,
-                                SUM(num_individuals_in_response) AS num_responses
-                         FROM question_rank_responses
-                                  JOIN
-                              respondents USING (respondent_id)
-                         WHERE question_id = {question_id}
-                         GROUP BY demographic, response_value
-                     ),
-                 fill_in_blanks AS
-                     (
-                         -- If a demographic doesn't have any responses, fill it in as 0
-                         SELECT demographic,
-                                demographic_order,
-                                response_value,
-                                COALESCE(num_responses, 0) AS num_responses
-                         FROM expected_values
-                                  LEFT JOIN
-                              sum_by_demographic USING (demographic, response_value)
-                     ),
-                 sum_w_totals AS
-                     (
-                         SELECT demographic,
-                                SUM(num_responses) AS total
-                         FROM fill_in_blanks
-                         GROUP BY demographic
-                     )
-            SELECT response_value,
-                   ARRAY_AGG(num_responses::NUMERIC / total ORDER BY demographic_order) AS pct
-            FROM fill_in_blanks
-                     JOIN
-                 sum_w_totals USING (demographic)
-            GROUP BY response_value
-            ;"""
+        counts=cube.counts(by='any_support', question_id=question_id,
+                           categories=SUPPORT),
+        intervals=intervals
     )
 
 
-def by_minority_summary(conn, question_id, summarized_text):
+def by_minority_summary(cube: RankCube, question_id, summarized_text, intervals: pd.DataFrame = None):
     subfolder = Path('artifacts/Rank Response - Minority')
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return chart_spec(
         title=f'{question_id}: ' + summarized_text,
         subfolder=subfolder,
         x_axis_label='Grade Level',
-        x_data_label_query=f"""
-            SELECT CASE
-                       WHEN minority THEN 'Minority'
-                       WHEN NOT minority THEN 'Not Minority'
-                       ELSE 'Did not answer'
-                       END ||
-                   E'\n(' ||
-                   ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                            SUM(num_individuals_in_response),
-                         2) ||
-                   ')' AS title
-            FROM question_rank_responses
-                     JOIN
-                 respondents USING (respondent_id)
-            WHERE question_id = {question_id}
-            GROUP BY minority
-            ORDER BY minority DESC NULLS LAST
-                    """,
-        proportion_query=f"""
-                WITH expected_values AS
-                         (
-                             SELECT demographics.column1    AS demographic,
-                                    demographics.column2    AS demographic_order, -- any_support desc nulls last
-                                    response_values.column1 AS response_value
-                             FROM (VALUES ('Minority', 1),
-                                          ('Not Minority', 2),
-                                          ('Did not answer', 3)) AS demographics,
-                                  (VALUES (1), (2), (3), (4)) AS response_values
-                         ),
-                     sum_by_demographic AS
-                         (
-                             SELECT CASE
-                                        WHEN minority THEN 'Minority'
-                                        WHEN NOT minority THEN 'Not Minority'
-                                        ELSE 'Did not answer'
-                                        END                          AS demographic,
-                                    response_value,
-                                    SUM(num_individuals_in_response) AS num_responses
-                             FROM question_rank_responses
-                                      JOIN
-                                  respondents USING (respondent_id)
-                             WHERE question_id = {question_id}
-                             GROUP BY demographic, response_value
-                         ),
-                     fill_in_blanks AS
-                         (
-                             -- If a demographic doesn't have any responses, fill it in as 0
-                             SELECT demographic,
-                                    demographic_order,
-                                    response_value,
-                                    COALESCE(num_responses, 0) AS num_responses
-                             FROM expected_values
-                                      LEFT JOIN
-                                  sum_by_demographic USING (demographic, response_value)
-                         ),
-                     sum_w_totals AS
-                         (
-                             SELECT demographic,
-                                    SUM(num_responses) AS total
-                             FROM fill_in_blanks
-                             GROUP BY demographic
-                         )
-                SELECT response_value,
-                       ARRAY_AGG(num_responses::NUMERIC / total ORDER BY demographic_order) AS pct
-                FROM fill_in_blanks
-                         JOIN
-                     sum_w_totals USING (demographic)
-                GROUP BY response_value
-                ;"""
+        counts=cube.counts(by='minority', question_id=question_id,
+                           categories=MINORITY),
+        intervals=intervals
     )
 
 
-def by_first_year_family_summary(conn, question_id, summarized_text):
+def by_first_year_family_summary(cube: RankCube, question_id, summarized_text, intervals: pd.DataFrame = None):
     subfolder = Path('artifacts/Rank Response - First Year Families')
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return chart_spec(
         title=f'{question_id}: ' + summarized_text,
         subfolder=subfolder,
         x_axis_label='Grade Level',
-        x_data_label_query=f"""
-            SELECT CASE
-                       WHEN tenure = 1 THEN 'First Year Family'
-                       WHEN not tenure = 1 THEN 'Returning Family'
-                       ELSE 'Did not answer'
-                       END ||
-                   E'\n(' ||
-                   ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                            SUM(num_individuals_in_response),
-                         2) ||
-                   ')' AS title
-            FROM question_rank_responses
-                     JOIN
-                 respondents USING (respondent_id)
-            WHERE question_id = {question_id}
-            GROUP BY tenure = 1
-            ORDER BY tenure = 1 DESC NULLS LAST
-                    """,
-        proportion_query=f"""
-                WITH expected_values AS
-                         (
-                             SELECT demographics.column1    AS demographic,
-                                    demographics.column2    AS demographic_order, -- any_support desc nulls last
-                                    response_values.column1 AS response_value
-                             FROM (VALUES ('First Year Family', 1),
-                                          ('Returning Family', 2),
-                                          ('Did not answer', 3)) AS demographics,
-                                  (VALUES (1), (2), (3), (4)) AS response_values
-                         ),
-                     sum_by_demographic AS
-                         (
-                             SELECT CASE
-                                        WHEN tenure = 1 THEN 'First Year Family'
-                                        WHEN NOT tenure = 1 THEN 'Returning Family'
-                                        ELSE 'Did not answer'
-                                        END                          AS demographic,
-                                    response_value,
-                                    SUM(num_individuals_in_response) AS num_responses
-                             FROM question_rank_responses
-                                      JOIN
-                                  respondents USING (respondent_id)
-                             WHERE question_id = {question_id}
-                             GROUP BY tenure = 1, response_value
-                         ),
-                     fill_in_blanks AS
-                         (
-                             -- If a demographic doesn't have any responses, fill it in as 0
-                             SELECT demographic,
-                                    demographic_order,
-                                    response_value,
-                                    COALESCE(num_responses, 0) AS num_responses
-                             FROM expected_values
-                                      LEFT JOIN
-                                  sum_by_demographic USING (demographic, response_value)
-                         ),
-                     sum_w_totals AS
-                         (
-                             SELECT demographic,
-                                    SUM(num_responses) AS total
-                             FROM fill_in_blanks
-                             GROUP BY demographic
-                         )
-                SELECT response_value,
-                       ARRAY_AGG(num_responses::NUMERIC / total ORDER BY demographic_order) AS pct
-                FROM fill_in_blanks
-                         JOIN
-                     sum_w_totals USING (demographic)
-                GROUP BY response_value
-                ;"""
+        counts=cube.counts(by='first_year', question_id=question_id,
+                           categories=FIRST_YEAR),
+        intervals=intervals
     )
 
 
-def q5_student_services(conn):
-    query_to_bar_chart(
-        conn=conn,
+def q5_student_services(cube: RankCube):
+    return chart_spec(
         title='Q5 (Virtues) with Services Received',
         x_axis_label='Group Status\n(avg score)',
-        x_data_label_query="""
-            WITH question_avg_score AS
-                 (
-                     SELECT 'Total'                                                                                                 AS secton_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND question_id = 5
-        
-                     UNION ALL
-                     SELECT 'Support Services'                                                                                      AS secton_id,
-                            ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC / SUM(num_individuals_in_response), 2) AS avg_score
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND question_id = 5
-                       AND any_support
-                 )
-            SELECT CONCAT(secton_id, E'\n',
-                          '(', avg_score, ')'
-                       ) AS title
-            FROM question_avg_score
-            ORDER BY secton_id
-            """,
-        proportion_query="""
-            WITH question_response_counts AS
-                 (
-                     SELECT 'Total'                          AS question_id,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND question_id = 5
-                     GROUP BY response_value
-        
-                     UNION ALL
-                     SELECT 'Support Services'               AS question_id,
-                            response_value,
-                            SUM(num_individuals_in_response) AS num_responses
-                     FROM question_rank_responses
-                              JOIN
-                          respondents USING (respondent_id)
-                     WHERE NOT soft_delete
-                       AND question_id = 5
-                       AND any_support
-                     GROUP BY response_value
-                 ),
-                 question_totals AS
-                 (
-                     SELECT question_id,
-                            SUM(num_responses) AS total
-                     FROM question_response_counts
-                     GROUP BY question_id
-                 )
-            SELECT response_value,
-                   ARRAY_AGG(num_responses::NUMERIC / total ORDER BY question_id) AS pct,
-                   ARRAY_AGG(question_id ORDER BY question_id)                    AS question_order
-            FROM question_response_counts
-                     JOIN
-                 question_totals USING (question_id)
-            GROUP BY response_value
-            """
+        counts=pd.concat([
+            cube.counts(by='any_support', categories={True: 'Support Services'}, question_id=5, include_soft_deleted=False),
+            cube.counts(question_id=5, include_soft_deleted=False),
+        ])
     )
 
 
-def yoy_question_diff(conn, question_id, summarized_text):
+def yoy_schemas() -> list:
+    """
+    YOY_SCHEMAS in the .env file lists the schemas compared by the year over year charts, e.g. sac_survey_2023,sac_survey_2024.
+    :return: list, or None to compare every sac_survey_* schema
+    """
+    schemas = load_optional_env_var('YOY_SCHEMAS')
+    return [schema.strip() for schema in schemas.split(',')] if schemas else None
+
+
+def yoy_question_diff(yoy_cubes: dict, question_id, summarized_text):
     subfolder = Path('artifacts/yoy_comparison')
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return chart_spec(
         title=f'{question_id}: ' + summarized_text,
         subfolder=subfolder,
         x_axis_label='',
-        x_data_label_query=f"""
-            WITH pop_2024 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2024.question_rank_responses
-                                  JOIN
-                              sac_survey_2024.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                           AND question_id = {question_id} 
-                     ),
-                 pop_2023 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2023.question_rank_responses
-                                  JOIN
-                              sac_survey_2023.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                           AND question_id = {question_id}
-                     ),
-                 distribution AS
-                     (
-                         SELECT '2024'                                                            AS yr,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                                      (SELECT SUM(num_individuals_in_response) FROM pop_2024), 2) AS pct
-                         FROM pop_2024
-
-                         UNION ALL
-
-                         SELECT '2023'                                                            AS yr,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                                      (SELECT SUM(num_individuals_in_response) FROM pop_2023), 2) AS pct
-                         FROM pop_2023
-                     )
-            SELECT CONCAT(yr, E'\n',
-                          '(', pct, ')'
-                       ) AS title
-            FROM distribution
-            ORDER BY yr
-            """,
-        proportion_query=f"""
-            WITH pop_2024 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2024.question_rank_responses
-                                  JOIN
-                              sac_survey_2024.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                           AND question_id = {question_id}
-                     ),
-                 pop_2023 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2023.question_rank_responses
-                                  JOIN
-                              sac_survey_2023.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                           AND question_id = {question_id}
-                     ),
-                 distribution AS
-                     (
-                         SELECT '2024'                                                  AS yr,
-                                response_value,
-                                SUM(num_individuals_in_response)::NUMERIC /
-                                (SELECT SUM(num_individuals_in_response) FROM pop_2024) AS pct
-                         FROM pop_2024
-                         GROUP BY response_value
-
-                         UNION ALL
-
-                         SELECT '2023'                                                  AS yr,
-                                response_value,
-                                SUM(num_individuals_in_response)::NUMERIC /
-                                (SELECT SUM(num_individuals_in_response) FROM pop_2023) AS pct
-                         FROM pop_2023
-                         GROUP BY response_value
-
-                         ORDER BY response_value
-                     )
-            SELECT response_value,
-                   ARRAY_AGG(pct ORDER BY yr)  AS pct,
-                   ARRAY_AGG(yr ORDER BY yr) AS year_order
-            FROM distribution
-            GROUP BY response_value
-            """
+        counts=yoy_question_counts(yoy_cubes, question_id)
     )
 
 
-def yoy_total_diff(conn):
+def yoy_question_counts(yoy_cubes: dict, question_id) -> pd.DataFrame:
+    """
+    :return: one row per year, oldest first, like RankCube.counts()
+    """
+    return pd.concat([cube.counts(question_id=question_id, include_soft_deleted=False).rename(index={'Total': year})
+                      for year, cube in sorted(yoy_cubes.items())])
+
+
+def yoy_total_diff(yoy_cubes: dict):
     subfolder = Path('artifacts/yoy_comparison')
     subfolder.mkdir(parents=True, exist_ok=True)
-    query_to_bar_chart(
-        conn=conn,
+    return chart_spec(
         title='YoY total difference',
         subfolder=subfolder,
         x_axis_label='',
-        x_data_label_query="""
-            WITH pop_2024 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2024.question_rank_responses
-                                  JOIN
-                              sac_survey_2024.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                     ),
-                 pop_2023 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2023.question_rank_responses
-                                  JOIN
-                              sac_survey_2023.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                     ),
-                 distribution AS
-                     (
-                         SELECT '2024'                                                            AS yr,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                                      (SELECT SUM(num_individuals_in_response) FROM pop_2024), 2) AS pct
-                         FROM pop_2024
-
-                         UNION ALL
-
-                         SELECT '2023'                                                            AS yr,
-                                ROUND(SUM(response_value * num_individuals_in_response)::NUMERIC /
-                                      (SELECT SUM(num_individuals_in_response) FROM pop_2023), 2) AS pct
-                         FROM pop_2023
-                     )
-            SELECT CONCAT(yr, E'\n',
-                          '(', pct, ')'
-                       ) AS title
-            FROM distribution
-            ORDER BY yr
-            """,
-        proportion_query="""
-            WITH pop_2024 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2024.question_rank_responses
-                                  JOIN
-                              sac_survey_2024.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                     ),
-                 pop_2023 AS
-                     (
-                         SELECT question_id,
-                                response_value,
-                                num_individuals_in_response
-                         FROM sac_survey_2023.question_rank_responses
-                                  JOIN
-                              sac_survey_2023.respondents USING (respondent_id)
-                         WHERE NOT soft_delete
-                     ),
-                 distribution AS
-                     (
-                         SELECT '2024'                                                  AS yr,
-                                response_value,
-                                SUM(num_individuals_in_response)::NUMERIC /
-                                (SELECT SUM(num_individuals_in_response) FROM pop_2024) AS pct
-                         FROM pop_2024
-                         GROUP BY response_value
-
-                         UNION ALL
-
-                         SELECT '2023'                                                  AS yr,
-                                response_value,
-                                SUM(num_individuals_in_response)::NUMERIC /
-                                (SELECT SUM(num_individuals_in_response) FROM pop_2023) AS pct
-                         FROM pop_2023
-                         GROUP BY response_value
-
-                         ORDER BY response_value
-                     )
-            SELECT response_value,
-                   ARRAY_AGG(pct ORDER BY yr)  AS pct,
-                   ARRAY_AGG(yr ORDER BY yr) AS year_order
-            FROM distribution
-            GROUP BY response_value
-            """
+        counts=pd.concat([cube.counts(include_soft_deleted=False).rename(index={'Total': year})
+                          for year, cube in sorted(yoy_cubes.items())])
     )
 
 
+def build_chart_specs(chart_data: dict, breakouts=False, only: set = None) -> list:
+    """
+    Every chart this script draws, to render or to add to a report (see report.py).
+
+    :param chart_data: from load_chart_data()
+    :param breakouts: add breakout_by_question(), five charts for each question
+    :param only: see breakout_by_question()
+    :return: list of ChartSpec
+    """
+    cube = chart_data['cube']
+    chart_specs = [
+        # create_question_summary(cube),
+        create_grade_summary(cube),
+        # q5_student_services(cube),
+    ]
+    if breakouts:
+        chart_specs += breakout_by_question(cube, chart_data['questions'], chart_data['yoy_cubes'], chart_data['engine'], only)
+    # chart_specs.append(yoy_total_diff(chart_data['yoy_cubes']))  # needs load_chart_data(yoy=True)
+    return chart_specs
+
+
+def build_charts(eng, write_screening=True) -> list:
+    """
+    Load what the charts need, and describe each chart, following the settings in the .env file:
+        CHART_BREAKOUTS adds the breakout charts: grade level, support, minority, first year family, and year over year, for each question
+        CHART_CONFIDENCE_INTERVALS adds 95% intervals to the average scores of the breakout charts
+        CHART_SCREENING tests every breakout for differences between its groups; see save_screening()
+        CHART_ONLY_SIGNIFICANT screens the breakouts, and only draws the breakout charts which differ
+        CHART_QUERY_WORKERS limits how many queries run at the same time
+
+    :param eng: sqlalchemy Engine
+    :param write_screening: save and log the screening with save_screening().  Otherwise CHART_SCREENING is ignored,
+        and the breakouts are only screened to pick the charts for CHART_ONLY_SIGNIFICANT
+    :return: list of ChartSpec
+    """
+    breakouts = load_optional_env_flag('CHART_BREAKOUTS')
+    only_significant = load_optional_env_flag('CHART_ONLY_SIGNIFICANT')
+    confidence_intervals = load_optional_env_flag('CHART_CONFIDENCE_INTERVALS')
+    for setting, value in (('CHART_ONLY_SIGNIFICANT', only_significant), ('CHART_CONFIDENCE_INTERVALS', confidence_intervals)):
+        if value and not breakouts:
+            logging.warning('%s only changes the breakout charts; set CHART_BREAKOUTS=true to draw them', setting)
+
+    screening = (load_optional_env_flag('CHART_SCREENING') and write_screening) or only_significant
+
+    # Every query at once: one for every chart of this year's results, one for the question text,
+    # and one per year compared, which only the breakouts and their screening use
+    chart_data = load_chart_data(eng, max_workers=int(load_optional_env_var('CHART_QUERY_WORKERS', 0)) or None, yoy=breakouts or screening,
+                                 breakout_engine=breakouts and confidence_intervals)
+
+    only = None
+    if screening:
+        results = screen_breakouts(chart_data['cube'], chart_data['questions'], chart_data['yoy_cubes'])
+        if write_screening:
+            save_screening(results)
+        only = significant_breakouts(results) if only_significant else None
+    return build_chart_specs(chart_data, breakouts, only)
+
+
+def save_screening(screening: pd.DataFrame, filepath='artifacts/breakout_screening.csv') -> None:
+    """
+    Save the results of screen_breakouts(), most significant first, and log the breakouts which differ.
+    """
+    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+    screening.to_csv(filepath, index=False)
+    significant = screening[screening.significant]
+    logging.info('%s of %s breakouts differ between their groups (saved to %s):\n%s',
+                 len(significant), len(screening), filepath, significant[['question_id', 'dimension', 'average_spread']].to_string(index=False))
+
+
+def significant_breakouts(screening: pd.DataFrame) -> set:
+    """
+    :param screening: from screen_breakouts()
+    :return: set of (question_id, dimension) for breakout_by_question(only=...)
+    """
+    return set(zip(screening.question_id[screening.significant], screening.dimension[screening.significant]))
+
+
 def main():
-    with create_engine(DATABASE_CONNECTION_STRING).connect() as conn:
-        conn.execute(f"SET SCHEMA '{DATABASE_SCHEMA}'")
-
-        # create_question_summary(conn)
-        create_grade_summary(conn)
-        # q5_student_services(conn)
-        # breakout_by_question(conn)
-        # yoy_total_diff(conn)
+    # ANALYSIS_FROM_SNAPSHOT reads the Parquet files written by snapshots.py instead of the database
+    eng = snapshot_engine() if load_optional_env_flag('ANALYSIS_FROM_SNAPSHOT') else get_engine(DATABASE_CONNECTION_STRING)
+    chart_specs = build_charts(eng)
+
+    # CHART_HEADLESS saves the charts without showing them; CHART_PROCESSES also renders them in parallel
+    render_charts(chart_specs, processes=int(load_optional_env_var('CHART_PROCESSES', 0)),
+                  headless=load_optional_env_flag('CHART_HEADLESS'), force_rebuild=load_optional_env_flag('REBUILD_ARTIFACTS'))
 
 
 if __name__ == '__main__':
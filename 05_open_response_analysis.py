@@ -1,31 +1,49 @@
 import pandas as pd
-from sqlalchemy import create_engine
+import wordcloud as wordcloud_package
 from wordcloud import WordCloud, STOPWORDS
 
-from utilities import load_env_vars
+from snapshots import snapshot_engine
+from utilities import ArtifactCache, cached_read_sql, get_engine, load_env_vars, load_optional_env_flag, translate_sql
 
 _, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
 
+WORDCLOUD_PARAMETERS = {
+    'max_words': 50,
+    'min_word_length': 3,
+    'relative_scaling': 1,  # frequency determines word size
+    'scale': 4,  # image size
+    'colormap': 'PuOr',  # semi-close to GVCA colors.  Can also try YlGnBu
+    'background_color': None, 'mode': "RGBA",  # transparent background
+}
+
+# Curate a list of stopwords
+WORDCLOUD_STOPWORDS = set(STOPWORDS) | {"GVCA", "School", "Golden", "View", "Academy",
+                                        "Child", "Children", "Student", "Students", "Kids",
+                                        "Grader", "Grammar", "Middle", "High",
+                                        "Year", "Really", "Often", "Don"
+                                        }
+
 
 def main():
-    eng = create_engine(DATABASE_CONNECTION_STRING)
+    # ANALYSIS_FROM_SNAPSHOT reads the Parquet files written by snapshots.py instead of the database
+    eng = snapshot_engine() if load_optional_env_flag('ANALYSIS_FROM_SNAPSHOT') else get_engine(DATABASE_CONNECTION_STRING)
     with eng.connect() as conn:
         conn.execute(f"SET SCHEMA '{DATABASE_SCHEMA}';")
-        build_wordclouds(conn)
+        build_wordclouds(conn, force_rebuild=load_optional_env_flag('REBUILD_ARTIFACTS'))
 
 
-def build_wordclouds(conn):
+def build_wordclouds(conn, force_rebuild=False) -> list:
     """
     Create wordclouds for each open response section.
     Have separate plots for each grade level, as well as one with all results together.
+    Wordclouds of the same responses as last time are copied from the ArtifactCache instead of being generated again.
+
+    :param force_rebuild: generate every wordcloud, even if the responses haven't changed
+    :return: list of (title, filepath) for each wordcloud, e.g. to add to a report (see report.py)
     """
-    # Curate a list of stopwords
-    stopwords = set(STOPWORDS)
-    stopwords.update(["GVCA", "School", "Golden", "View", "Academy",
-                      "Child", "Children", "Student", "Students", "Kids",
-                      "Grader", "Grammar", "Middle", "High",
-                      "Year", "Really", "Often", "Don"
-                      ])
+    cache = ArtifactCache(force_rebuild=force_rebuild)
+    wordclouds = []
+    stopwords = WORDCLOUD_STOPWORDS
 
     # Separate plots for each grade level (and one for all responses together)
     for grade_level, subtitle in [(None, 'All Response'),
@@ -35,8 +53,8 @@ def build_wordclouds(conn):
 
         # no `grade_level_filter` when looking at all responses
         grade_level_filter = f'AND {grade_level}' if grade_level else ''
-        df = pd.read_sql(con=conn,
-                         sql=f"""
+        df = cached_read_sql(conn=conn,
+                             sql=translate_sql(conn, f"""
                                 SELECT question_id,
                                        question_text,
                                        response
@@ -45,30 +63,32 @@ def build_wordclouds(conn):
                                      questions USING (question_id)
                                 WHERE response IS NOT NULL
                                       {grade_level_filter}
-                             """)
+                             """))
 
         for question_id in df.question_id.unique():
             # expect one "positive" and one "negative" question
             text = " ".join(df[df.question_id == question_id].response.tolist())
             title = df[df.question_id == question_id].question_text.values[0]
 
-            build_wordcloud(text, stopwords, title, subtitle)
+            output_filepath = f"artifacts/Open Response/{title} - {subtitle}.png"
+            cache_inputs = {'text': text, 'stopwords': sorted(stopwords), 'parameters': WORDCLOUD_PARAMETERS,
+                            'wordcloud': wordcloud_package.__version__}
+            if not cache.restore(output_filepath, cache_inputs):
+                build_wordcloud(text, stopwords, output_filepath)
+                cache.store(output_filepath, cache_inputs)
+            wordclouds.append((f'{title} - {subtitle}', output_filepath))
+
+    cache.print_summary('Wordclouds')
+    return wordclouds
 
 
-def build_wordcloud(text, stopwords, title, subtitle):
+def build_wordcloud(text, stopwords, output_filepath):
     """
     Generate a word cloud image with a transparent background.
     Save as a file in the artifacts/ folder.
     """
-    wordcloud = WordCloud(stopwords=stopwords,
-                          max_words=50,
-                          min_word_length=3,
-                          relative_scaling=1,  # frequency determines word size
-                          scale=4,  # image size
-                          colormap='PuOr',  # semi-close to GVCA colors.  Can also try YlGnBu
-                          background_color=None, mode="RGBA",  # transparent background
-                          ).generate(text)
-    wordcloud.to_file(f"artifacts/Open Response/{title} - {subtitle}.png")
+    wordcloud = WordCloud(stopwords=stopwords, **WORDCLOUD_PARAMETERS).generate(text)
+    wordcloud.to_file(output_filepath)
 
 
 def analysis_of_categories(eng):
@@ -98,7 +118,7 @@ def analysis_of_categories(eng):
         ORDER BY question_id, sub_question_id, total DESC, category
         ;
         """
-    return pd.read_sql(sql=analysis_query, con=eng)
+    return pd.read_sql(sql=translate_sql(eng, analysis_query), con=eng)
 
 
 def manual_categorization(eng):
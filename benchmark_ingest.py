@@ -0,0 +1,168 @@
+"""
+Measure 02_data_ingest.py on synthetic exports of increasing size, for each ingest mode.
+Reports rows/sec, database round trips, and peak memory, so performance can be compared across versions.
+
+The target schema must already exist (see 01_build_database.sql).  Its respondents and responses are deleted before every run.
+
+    python benchmark_ingest.py --rows 100 1000 10000 --modes rows bulk vectorized --output bench.json
+    python benchmark_ingest.py --check-resume    # check a chunked load which failed can be finished from a corrected file
+"""
+import argparse
+import csv
+import importlib
+import json
+import resource
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from time import perf_counter
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
+
+from generate_synthetic_survey import generate_survey
+from utilities import load_env_vars
+
+_, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
+
+# keyword arguments to 02_data_ingest.main() for each mode
+INGEST_MODES = {
+    'rows': {},
+    'bulk': {'bulk_load': True},
+    'chunked': {'bulk_load': True, 'chunk_size': 500},
+    'vectorized': {'engine': 'vectorized'},
+}
+
+
+def main(row_counts, modes, database_schema, database_connection_string, output_filepath=None):
+    results = []
+    with tempfile.TemporaryDirectory() as temp_directory:
+        for num_rows in row_counts:
+            input_filepath = str(Path(temp_directory) / f'synthetic_{num_rows}.csv')
+            generate_survey(input_filepath, num_rows)
+
+            for mode in modes:
+                reset_schema(database_schema, database_connection_string)
+                # A fresh process for each run, so peak memory belongs to that run alone
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    result = pool.submit(run_ingest, mode, input_filepath, database_schema, database_connection_string).result()
+
+                result.update({'rows': num_rows, 'rows_per_second': num_rows / result['seconds']})
+                results.append(result)
+                print(f"{mode:>10} {num_rows:>9} rows: {result['seconds']:8.2f}s {result['rows_per_second']:10.0f} rows/s "
+                      f"{result['round_trips']:>9} round trips {result['peak_rss_mb']:8.1f} MB peak RSS")
+
+    if output_filepath:
+        with open(output_filepath, 'w') as f_out:
+            json.dump(results, f_out, indent=2)
+    return results
+
+
+def run_ingest(mode, input_filepath, database_schema, database_connection_string):
+    """
+    Run one ingest and measure it.  Runs in its own process.
+
+    :return: {'mode': str, 'seconds': float, 'round_trips': int, 'peak_rss_mb': float}
+    """
+    data_ingest = importlib.import_module('02_data_ingest')
+
+    # Every statement sent through sqlalchemy, plus each bulk write which goes straight to the DBAPI connection:
+    # COPY on postgres, and the DataFrame scan on DuckDB
+    round_trips = {'count': 0}
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count_statement(*args, **kwargs):
+        round_trips['count'] += 1
+
+    for bulk_writer_name in ['copy_to_table', 'append_to_duckdb_table']:
+        setattr(data_ingest, bulk_writer_name, counted(getattr(data_ingest, bulk_writer_name), round_trips))
+
+    start_time = perf_counter()
+    data_ingest.main(input_filepath=input_filepath, database_schema=database_schema,
+                     database_connection_string=database_connection_string, **INGEST_MODES[mode])
+    seconds = perf_counter() - start_time
+
+    # ru_maxrss is in kilobytes on Linux, and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / 1024 / 1024 if sys.platform == 'darwin' else peak_rss / 1024
+    return {'mode': mode, 'seconds': seconds, 'round_trips': round_trips['count'], 'peak_rss_mb': peak_rss_mb}
+
+
+def counted(bulk_writer, round_trips: dict):
+    """
+    :return: bulk_writer, counting each call as one round trip
+    """
+    def count_bulk_write(*args, **kwargs):
+        round_trips['count'] += 1
+        return bulk_writer(*args, **kwargs)
+
+    return count_bulk_write
+
+
+def check_resume(database_schema, database_connection_string, num_rows=2000, chunk_size=500, bad_row=1200):
+    """
+    Load a file in chunks until a bad row stops it, correct the row, and load the corrected file.
+    The corrected file has a different hash than its checkpoint, so it's read from the top, and the respondents committed
+    before the failure must be skipped rather than inserted again.
+    """
+    data_ingest = importlib.import_module('02_data_ingest')
+    ingest_options = {'database_schema': database_schema, 'database_connection_string': database_connection_string,
+                      'bulk_load': True, 'chunk_size': chunk_size}
+    reset_schema(database_schema, database_connection_string)
+    with tempfile.TemporaryDirectory() as temp_directory:
+        input_filepath = str(Path(temp_directory) / 'synthetic.csv')
+        generate_survey(input_filepath, num_rows)
+        with open(input_filepath, newline='') as f_in:
+            rows = list(csv.reader(f_in))
+
+        # 2 header rows, then the answers; column 133 is tenure
+        tenure = rows[bad_row + 1][133]
+        rows[bad_row + 1][133] = 'abc'
+        write_rows(input_filepath, rows)
+        try:
+            data_ingest.main(input_filepath=input_filepath, **ingest_options)
+            raise AssertionError(f'Row {bad_row} should have stopped the load')
+        except ValueError:
+            pass
+
+        rows[bad_row + 1][133] = tenure
+        write_rows(input_filepath, rows)
+        data_ingest.main(input_filepath=input_filepath, **ingest_options)
+
+    with create_engine(database_connection_string).connect() as conn:
+        num_loaded = conn.execute(f'SELECT COUNT(*) FROM {database_schema}.respondents;').scalar()
+    assert num_loaded == num_rows, f'{num_loaded} respondents loaded from {num_rows} rows'
+    print(f'Resumed from a corrected file: {num_loaded} of {num_rows} respondents loaded once each')
+
+
+def write_rows(filepath, rows):
+    with open(filepath, 'w', newline='') as f_out:
+        csv.writer(f_out).writerows(rows)
+
+
+def reset_schema(database_schema, database_connection_string):
+    """
+    Delete everything the ingest writes, so each run starts from the same empty schema.
+    """
+    with create_engine(database_connection_string).connect() as conn:
+        for tablename in ['question_rank_responses', 'question_open_responses', 'respondents', 'ingest_checkpoints']:
+            if inspect(conn).has_table(tablename, schema=database_schema):
+                conn.execute(f'DELETE FROM {database_schema}.{tablename};')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000], help='number of respondents in each synthetic file')
+    parser.add_argument('--modes', nargs='+', choices=list(INGEST_MODES), default=list(INGEST_MODES))
+    parser.add_argument('--schema', default=DATABASE_SCHEMA, help='schema to load into; defaults to DATABASE_SCHEMA')
+    parser.add_argument('--connection-string', default=DATABASE_CONNECTION_STRING,
+                        help='SQLAlchemy connection string; defaults to DATABASE_CONNECTION_STRING')
+    parser.add_argument('--output', help='also write the results to this json file')
+    parser.add_argument('--check-resume', action='store_true', help='run check_resume() instead of the benchmark')
+    args = parser.parse_args()
+
+    if args.check_resume:
+        check_resume(args.schema, args.connection_string)
+    else:
+        main(args.rows, args.modes, args.schema, args.connection_string, args.output)
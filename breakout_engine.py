@@ -0,0 +1,177 @@
+"""
+Explore breakouts of the rank questions in a notebook without writing SQL.
+
+BreakoutEngine loads the rank responses once, as compact NumPy arrays (one entry per answered question),
+and computes any breakout, or crossing of breakouts, with a single np.bincount.
+Every combination of categories is included, with 0 where nobody answered, so there is no need for the
+`expected_values` / `fill_in_blanks` pattern used in SQL.
+
+    engine = BreakoutEngine.load(conn)
+    counts = engine.breakout('level', 'any_support', question_id=5)
+    average_scores(counts), proportions(counts)
+
+The counts have the same layout as RankCube.counts(), so rank_cube.chart_inputs() turns them into a chart.
+"""
+import numpy as np
+import pandas as pd
+
+from utilities import cached_read_sql
+
+RESPONSE_VALUES = [1, 2, 3, 4]
+
+# (label, lowest tenure, highest tenure) for the `tenure_bucket` breakout
+TENURE_BUCKETS = [('1 year', 1, 1), ('2-3 years', 2, 3), ('4-6 years', 4, 6), ('7+ years', 7, None)]
+
+RANK_RESPONSES_QUERY = """
+    SELECT respondent_id,
+           question_id,
+           grammar,
+           middle,
+           high,
+           response_value,
+           num_individuals_in_response,
+           any_support,
+           minority,
+           tenure,
+           soft_delete
+    FROM {schema_prefix}question_rank_responses
+             JOIN
+         {schema_prefix}respondents USING (respondent_id)
+    WHERE response_value IS NOT NULL
+    """
+
+
+class BreakoutEngine:
+    """
+    Rank responses as arrays:
+        response_value int8, question_id int16, weight float32 (num_individuals_in_response),
+        respondent int32 (numbered from 0, for resampling respondents; see confidence_intervals.py),
+        and an int8 code for each breakout in `dimensions`, with its labels.
+    """
+
+    def __init__(self, rank_responses: pd.DataFrame):
+        """
+        :param rank_responses: result of RANK_RESPONSES_QUERY
+        """
+        self.response_value = rank_responses.response_value.to_numpy(dtype=np.int8)
+        self.question_id = rank_responses.question_id.to_numpy(dtype=np.int16)
+        # A respondent who didn't say how many people they answered for isn't counted, like SUM() skipping NULLs
+        self.weight = rank_responses.num_individuals_in_response.fillna(0).to_numpy(dtype=np.float32)
+        self.soft_delete = rank_responses.soft_delete.fillna(True).to_numpy(dtype=bool)
+        respondent_ids, respondent = np.unique(rank_responses.respondent_id.to_numpy(), return_inverse=True)
+        self.respondent = respondent.astype(np.int32)
+        self.num_respondents = len(respondent_ids)
+
+        tenure = rank_responses.tenure.astype(float).to_numpy()
+        question_ids = np.unique(self.question_id)
+
+        # dict(name: (int8 code for each response, label for each code))
+        self.dimensions = {
+            'question_id': (np.searchsorted(question_ids, self.question_id).astype(np.int8), [int(q) for q in question_ids]),
+            'level': (encode_level(rank_responses), ['Grammar', 'Middle', 'High']),
+            'any_support': (encode_yes_no(rank_responses.any_support), ['Received Support', 'Did not Receive Support', 'Did not answer']),
+            'minority': (encode_yes_no(rank_responses.minority), ['Minority', 'Not Minority', 'Did not answer']),
+            'first_year': (np.select([tenure == 1, ~np.isnan(tenure)], [0, 1], 2).astype(np.int8), ['First Year Family', 'Returning Family', 'Did not answer']),
+            'tenure_bucket': (encode_tenure_bucket(tenure), [label for label, _, _ in TENURE_BUCKETS] + ['Did not answer']),
+        }
+        # Row labels for each breakout which has been asked for, since building them costs more than the counting
+        self._indexes = {}
+
+    @classmethod
+    def load(cls, conn, database_schema: str = None):
+        """
+        :param conn: connection to database, or to snapshots (see snapshots.snapshot_engine())
+        :param database_schema: schema to read; defaults to the connection's current schema
+        :return: BreakoutEngine
+        """
+        query = RANK_RESPONSES_QUERY.format(schema_prefix=f'{database_schema}.' if database_schema else '')
+        return cls(cached_read_sql(conn, query, database_schema))
+
+    def breakout(self, *by: str, question_id: int = None, include_soft_deleted=True) -> pd.DataFrame:
+        """
+        Weighted number of responses for each response value, for every combination of the categories in `by`.
+
+        :param by: names of `dimensions` to break out by, e.g. ('level', 'minority'); none for the total
+        :param question_id: only count responses to this question
+        :param include_soft_deleted: set to False to leave out respondents removed by 03_QA_Checks.sql
+        :return: DataFrame with one row per combination of categories (or a single 'Total' row), and one column per response value
+        """
+        cell, weight, _, index = self.cells(*by, question_id=question_id, include_soft_deleted=include_soft_deleted)
+        counts = np.bincount(cell, weights=weight, minlength=len(index) * len(RESPONSE_VALUES))
+        return pd.DataFrame(counts.reshape(len(index), len(RESPONSE_VALUES)), index=index, columns=RESPONSE_VALUES)
+
+    def cells(self, *by: str, question_id: int = None, include_soft_deleted=True) -> tuple:
+        """
+        Number each (combination of categories, response value) of a breakout, and find the one each response falls in.
+        See breakout() for the parameters.
+
+        :return: (cell: int64 array, combination * len(RESPONSE_VALUES) + response value's position, for each response counted,
+                  weight: float32 array of those responses' weights,
+                  respondent: int32 array of who gave each of those responses,
+                  index: labels for each combination of categories)
+        """
+        mask = None
+        if question_id is not None:
+            mask = self.question_id == question_id
+        if not include_soft_deleted:
+            mask = ~self.soft_delete if mask is None else mask & ~self.soft_delete
+
+        # Number each combination of categories, like digits in a mixed radix number
+        combination = np.zeros(len(self.response_value), dtype=np.int64)
+        labels = []
+        for dimension in by:
+            codes, dimension_labels = self.dimensions[dimension]
+            combination = combination * len(dimension_labels) + codes
+            labels.append(dimension_labels)
+
+        cell = combination * len(RESPONSE_VALUES) + (self.response_value - RESPONSE_VALUES[0])
+        weight, respondent = self.weight, self.respondent
+        if mask is not None:
+            cell, weight, respondent = cell[mask], weight[mask], respondent[mask]
+
+        if by not in self._indexes:
+            if len(by) == 0:
+                self._indexes[by] = pd.Index(['Total'])
+            elif len(by) == 1:
+                self._indexes[by] = pd.Index(labels[0], name=by[0])
+            else:
+                self._indexes[by] = pd.MultiIndex.from_product(labels, names=by)
+        return cell, weight, respondent, self._indexes[by]
+
+
+def encode_level(rank_responses: pd.DataFrame) -> np.ndarray:
+    return np.select([rank_responses.grammar.to_numpy(dtype=bool), rank_responses.middle.to_numpy(dtype=bool)], [0, 1], 2).astype(np.int8)
+
+
+def encode_yes_no(answers: pd.Series) -> np.ndarray:
+    """
+    :return: 0 for yes, 1 for no, 2 for didn't answer
+    """
+    return np.select([answers.eq(True).to_numpy(), answers.eq(False).to_numpy()], [0, 1], 2).astype(np.int8)
+
+
+def encode_tenure_bucket(tenure: np.ndarray) -> np.ndarray:
+    """
+    :param tenure: years at GVCA, NaN when not answered
+    :return: index into TENURE_BUCKETS, or len(TENURE_BUCKETS) for didn't answer
+    """
+    conditions = [(tenure >= lowest) & (tenure <= (highest if highest is not None else np.inf)) for _, lowest, highest in TENURE_BUCKETS]
+    return np.select(conditions, range(len(TENURE_BUCKETS)), len(TENURE_BUCKETS)).astype(np.int8)
+
+
+def average_scores(counts: pd.DataFrame) -> pd.Series:
+    """
+    Weighted average response value for each row of a breakout; NaN where nobody answered.
+    """
+    totals = counts.sum(axis=1).to_numpy()
+    weighted_sums = counts.to_numpy() @ np.array(counts.columns, dtype=float)
+    return pd.Series(np.divide(weighted_sums, totals, out=np.full(len(totals), np.nan), where=totals > 0), index=counts.index)
+
+
+def proportions(counts: pd.DataFrame) -> pd.DataFrame:
+    """
+    Share of each row's responses giving each response value; 0 where nobody answered.
+    """
+    totals = counts.sum(axis=1).to_numpy()[:, np.newaxis]
+    return pd.DataFrame(np.divide(counts.to_numpy(), totals, out=np.zeros(counts.shape), where=totals > 0),
+                        index=counts.index, columns=counts.columns)
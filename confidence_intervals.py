@@ -0,0 +1,89 @@
+"""
+How much could each average score and response proportion move if a different set of families had answered?
+Small groups (e.g. "Received Support" in a single grade) can look very different from the rest by chance alone.
+
+bootstrap_breakout() resamples respondents, keeping all of each respondent's answers together, and weights each
+response by num_individuals_in_response, like every other count in the analysis.  Each respondent is drawn a
+Poisson(1) number of times (the Poisson bootstrap), which matches drawing n respondents with replacement for any
+survey of this size, and lets every resample of every group be counted in one matrix product:
+
+    (resamples x respondents) @ (respondents x cells) = weighted counts for every resample of every cell
+
+where a cell is one response value within one combination of categories, as in BreakoutEngine.breakout().
+Include 'question_id' in the breakout to do every question at once, and draw the resamples once to share them between breakouts:
+
+    engine = BreakoutEngine.load(conn)
+    resamples = draw_resamples(engine)
+    intervals = bootstrap_breakout(engine, 'question_id', 'level', resamples=resamples)
+    intervals['average'].loc[5]    # average, lower, upper for each grade level on question 5
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from breakout_engine import RESPONSE_VALUES, BreakoutEngine, average_scores
+
+
+def draw_resamples(engine: BreakoutEngine, num_resamples: int = 2000, seed: int = None) -> np.ndarray:
+    """
+    :param num_resamples: number of bootstrap resamples
+    :param seed: for repeatable intervals
+    :return: float32 array of how many times each respondent is drawn in each resample, (num_resamples x respondents)
+    """
+    rng = np.random.default_rng(seed)
+    return rng.poisson(1.0, size=(num_resamples, engine.num_respondents)).astype(np.float32)
+
+
+def bootstrap_breakout(engine: BreakoutEngine, *by: str, question_id: int = None, include_soft_deleted=True,
+                       confidence: float = 0.95, resamples: np.ndarray = None) -> dict:
+    """
+    Bootstrap confidence intervals for a breakout's average scores and response proportions.
+
+    :param engine: BreakoutEngine
+    :param by: names of engine.dimensions to break out by; see BreakoutEngine.breakout()
+    :param question_id: only count responses to this question
+    :param include_soft_deleted: set to False to leave out respondents removed by 03_QA_Checks.sql
+    :param confidence: e.g. 0.95 for 95% intervals
+    :param resamples: from draw_resamples(); drawn with its defaults if not given
+    :return: {'average': DataFrame with one row per combination of categories, and columns `average`, `lower`, `upper`,
+              'proportion_lower', 'proportion_upper': DataFrames shaped like engine.breakout(), with the bounds of each proportion}
+        Bounds are NaN for groups nobody answered.
+    """
+    cell, weight, respondent, index = engine.cells(*by, question_id=question_id, include_soft_deleted=include_soft_deleted)
+    num_cells = len(index) * len(RESPONSE_VALUES)
+
+    # Weighted responses of each respondent in each cell.  Respondents only answer a few cells, but even dense it's small
+    respondent_cells = np.bincount(respondent.astype(np.int64) * num_cells + cell, weights=weight,
+                                   minlength=engine.num_respondents * num_cells)
+    respondent_cells = respondent_cells.reshape(engine.num_respondents, num_cells).astype(np.float32)
+
+    resamples = draw_resamples(engine) if resamples is None else resamples
+    counts = (resamples @ respondent_cells).reshape(len(resamples), len(index), len(RESPONSE_VALUES))
+
+    totals = counts.sum(axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = (counts @ np.array(RESPONSE_VALUES, dtype=np.float32)) / totals
+        shares = counts / totals[:, :, np.newaxis]
+
+    # A group can come up empty in some resamples; those don't count towards its interval
+    tail = (1 - confidence) / 2
+    average_bounds = quantiles(averages, [tail, 1 - tail])
+    proportion_bounds = quantiles(shares, [tail, 1 - tail])
+
+    observed = engine.breakout(*by, question_id=question_id, include_soft_deleted=include_soft_deleted)
+    return {
+        'average': pd.DataFrame({'average': average_scores(observed), 'lower': average_bounds[0], 'upper': average_bounds[1]}, index=index),
+        'proportion_lower': pd.DataFrame(proportion_bounds[0], index=index, columns=RESPONSE_VALUES),
+        'proportion_upper': pd.DataFrame(proportion_bounds[1], index=index, columns=RESPONSE_VALUES),
+    }
+
+
+def quantiles(resampled: np.ndarray, q: list) -> np.ndarray:
+    """
+    Quantiles over the first axis (the resamples), ignoring NaN.  Columns which are NaN in every resample stay NaN.
+    """
+    with warnings.catch_warnings():
+        # "All-NaN slice", for groups nobody answered
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanquantile(resampled, q, axis=0)
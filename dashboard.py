@@ -0,0 +1,284 @@
+"""
+A local, read-only dashboard for "that chart, but only for X" questions, without rerunning the scripts.
+
+Everything is loaded once at startup, from the database or the Parquet snapshots (ANALYSIS_FROM_SNAPSHOT):
+    * the rank responses, counted into one dense array of weighted counts by question, grade level, support, minority,
+      first year family, tenure, and response value (with and without soft deleted respondents); see BreakoutCube
+    * the open responses, for word clouds
+After that, no request touches the database.  Each response is also kept in an LRU cache, by its path and parameters.
+
+    python dashboard.py    # http://localhost:8050; DASHBOARD_PORT and DASHBOARD_CACHE_SIZE in the .env file
+
+    /breakout.json?by=level&question_id=5&minority=Minority          counts, proportions, and average for each group
+    /breakout.png?by=level,any_support&first_year=First Year Family   the chart (or .svg)
+    /wordcloud.png?question_id=10&level=Grammar                      a word cloud of one open response question (or .svg, .json for word counts)
+    /                                                                the breakouts, and the labels each one can be filtered to
+
+Breakouts: `by` is a comma separated list of dimensions, and any dimension can be filtered to one or more of its labels
+(comma separated).  include_soft_deleted=false leaves out respondents removed by 03_QA_Checks.sql.
+"""
+import importlib
+import io
+import json
+import logging
+import textwrap
+from functools import lru_cache
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from wordcloud import WordCloud
+
+from breakout_engine import RESPONSE_VALUES, BreakoutEngine, average_scores, proportions
+from rank_cube import chart_inputs
+from snapshots import snapshot_engine
+from utilities import cached_read_sql, get_engine, load_env_vars, load_optional_env_flag, load_optional_env_var
+
+# The analysis scripts are named to sort in the order they're run, which `import` can't spell
+rank_question_charts = importlib.import_module('04_Rank_Question_Charts')
+open_response_analysis = importlib.import_module('05_open_response_analysis')
+
+_, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
+
+# Dimensions of BreakoutEngine which can be broken out by, or filtered to
+DIMENSIONS = ('question_id', 'level', 'any_support', 'minority', 'first_year', 'tenure_bucket')
+
+LEVELS = ('Grammar', 'Middle', 'High')
+
+OPEN_RESPONSES_QUERY = """
+    SELECT question_id,
+           question_text,
+           grammar,
+           middle,
+           high,
+           response
+    FROM {schema}.question_open_responses
+             JOIN
+         {schema}.questions USING (question_id)
+    WHERE response IS NOT NULL
+    """
+
+
+class NotFound(Exception):
+    """
+    A path or question the dashboard doesn't have, served as a 404.
+    """
+
+
+class BreakoutCube:
+    """
+    Weighted number of responses for every combination of DIMENSIONS and response value, as one dense array,
+    so any breakout, filtered any way, is a slice and a sum.
+    """
+
+    def __init__(self, engine: BreakoutEngine):
+        self.labels = {dimension: list(engine.dimensions[dimension][1]) for dimension in DIMENSIONS}
+        shape = [len(labels) for labels in self.labels.values()] + [len(RESPONSE_VALUES)]
+        # One for all respondents, one leaving out soft deleted ones
+        self.counts = {include_soft_deleted: engine.breakout(*DIMENSIONS, include_soft_deleted=include_soft_deleted).to_numpy().reshape(shape)
+                       for include_soft_deleted in (True, False)}
+
+    def breakout(self, by: tuple = (), filters: dict = None, include_soft_deleted=True) -> pd.DataFrame:
+        """
+        :param by: DIMENSIONS to break out by, in order; none for the total
+        :param filters: dict(dimension: list of labels to keep)
+        :param include_soft_deleted: set to False to leave out respondents removed by 03_QA_Checks.sql
+        :return: like BreakoutEngine.breakout(), but with the index labels joined by ' / ' for crossed breakouts
+        """
+        filters = filters or {}
+        for dimension in [*by, *filters]:
+            if dimension not in DIMENSIONS:
+                raise ValueError(f'Unknown dimension {dimension!r}; choose from {", ".join(DIMENSIONS)}')
+        if len(set(by)) < len(by):
+            raise ValueError(f'Each dimension can only be broken out by once, not {", ".join(by)}')
+
+        counts = self.counts[include_soft_deleted]
+        labels = dict(self.labels)
+        for axis, dimension in enumerate(DIMENSIONS):
+            if dimension in filters:
+                # Labels come in as text, so question 5 is '5'
+                positions = [self.position(dimension, label) for label in filters[dimension]]
+                counts = counts.take(positions, axis=axis)
+                labels[dimension] = [labels[dimension][position] for position in positions]
+
+        # Add up every dimension not broken out by, and put the rest in the order asked for
+        counts = counts.sum(axis=tuple(axis for axis, dimension in enumerate(DIMENSIONS) if dimension not in by))
+        counts = counts.transpose([sorted(by, key=DIMENSIONS.index).index(dimension) for dimension in by] + [len(by)])
+
+        if by:
+            index = pd.MultiIndex.from_product([labels[dimension] for dimension in by]).map(lambda label: ' / '.join(map(str, label)))
+        else:
+            index = pd.Index(['Total'])
+        return pd.DataFrame(counts.reshape(-1, len(RESPONSE_VALUES)), index=index, columns=RESPONSE_VALUES)
+
+    def position(self, dimension: str, label: str) -> int:
+        for position, dimension_label in enumerate(self.labels[dimension]):
+            if str(dimension_label) == label:
+                return position
+        raise ValueError(f'Unknown {dimension} {label!r}; choose from {", ".join(map(str, self.labels[dimension]))}')
+
+
+class Dashboard:
+    """
+    Everything the dashboard serves, loaded once.  render() turns a request into (content type, body), and is LRU cached.
+    """
+
+    def __init__(self, eng, database_schema=DATABASE_SCHEMA, cache_size: int = 256):
+        with eng.connect() as conn:
+            self.cube = BreakoutCube(BreakoutEngine.load(conn, database_schema))
+            self.questions = rank_question_charts.load_rank_questions(conn, database_schema)
+            self.open_responses = cached_read_sql(conn, OPEN_RESPONSES_QUERY.format(schema=database_schema), database_schema)
+        self.render = lru_cache(maxsize=cache_size)(self._render)
+
+    def _render(self, path: str, parameters: tuple) -> tuple:
+        """
+        :param path: e.g. '/breakout.png'
+        :param parameters: sorted (name, value) pairs from the query string
+        :return: (content type, bytes)
+        """
+        name, _, extension = path.strip('/').partition('.')
+        parameters = dict(parameters)
+        if name == '':
+            return json_response(self.index())
+        elif name == 'breakout' and extension in ('json', 'png', 'svg'):
+            counts, title = self.breakout(dict(parameters))
+            if extension == 'json':
+                return json_response(breakout_json(counts))
+            x_data_labels, chart_proportions = chart_inputs(counts)
+            # Crossed breakouts get a line per label, and a wider chart
+            x_data_labels = [x_data_label.replace(' / ', '\n') for x_data_label in x_data_labels]
+            return render_figure(lambda ax: rank_question_charts.draw_stacked_bar_chart(
+                ax, textwrap.fill(title, 70), parameters.get('by', ''), x_data_labels, chart_proportions),
+                extension, width=max(6.4, 1.8 * len(x_data_labels)))
+        elif name == 'wordcloud' and extension in ('json', 'png', 'svg'):
+            return self.wordcloud(parameters, extension)
+        raise NotFound(path)
+
+    def index(self) -> dict:
+        return {
+            'breakouts': '/breakout.json, /breakout.png, /breakout.svg',
+            'wordclouds': '/wordcloud.json, /wordcloud.png, /wordcloud.svg',
+            'dimensions': {dimension: [str(label) for label in labels] for dimension, labels in self.cube.labels.items()},
+            'rank_questions': {int(question_id): question_text for question_id, question_text in self.questions.itertuples(index=False, name=None)},
+            'open_response_questions': {int(question_id): question_text for question_id, question_text
+                                        in self.open_responses[['question_id', 'question_text']].drop_duplicates().itertuples(index=False, name=None)},
+        }
+
+    def breakout(self, parameters: dict) -> tuple:
+        """
+        :return: (counts from BreakoutCube.breakout(), chart title)
+        """
+        by = tuple(dimension for dimension in parameters.pop('by', '').split(',') if dimension)
+        include_soft_deleted = parameters.pop('include_soft_deleted', 'true').lower() != 'false'
+        filters = {dimension: labels.split(',') for dimension, labels in parameters.items()}
+        counts = self.cube.breakout(by, filters, include_soft_deleted)
+
+        question_ids = filters.get('question_id', [])
+        question_text = dict(self.questions.itertuples(index=False, name=None))
+        title = question_text.get(int(question_ids[0]), '') if len(question_ids) == 1 else 'All questions'
+        other_filters = [', '.join(labels) for dimension, labels in filters.items() if dimension != 'question_id']
+        return counts, ' - '.join([title, *other_filters])
+
+    def wordcloud(self, parameters: dict, extension: str) -> tuple:
+        if 'question_id' not in parameters:
+            raise ValueError('question_id is required')
+        responses = self.open_responses[self.open_responses.question_id.astype(str) == parameters['question_id']]
+        if responses.empty:
+            raise NotFound(f'open response question {parameters["question_id"]}')
+        level = parameters.get('level')
+        if level is not None:
+            if level not in LEVELS:
+                raise ValueError(f'Unknown level {level!r}; choose from {", ".join(LEVELS)}')
+            responses = responses[responses[level.lower()].astype(bool)]
+        if responses.empty:
+            raise ValueError('No responses to word cloud')
+
+        wordcloud = WordCloud(stopwords=open_response_analysis.WORDCLOUD_STOPWORDS, **open_response_analysis.WORDCLOUD_PARAMETERS)
+        text = ' '.join(responses.response)
+        if extension == 'json':
+            frequencies = sorted(wordcloud.process_text(text).items(), key=lambda item: -item[1])
+            return json_response(dict(frequencies[:wordcloud.max_words]))
+        wordcloud.generate(text)
+        if extension == 'svg':
+            return 'image/svg+xml', wordcloud.to_svg().encode('utf-8')
+        image = io.BytesIO()
+        wordcloud.to_image().save(image, format='png')
+        return 'image/png', image.getvalue()
+
+
+def breakout_json(counts: pd.DataFrame) -> list:
+    averages = average_scores(counts)
+    shares = proportions(counts)
+    return [{'group': label,
+             'counts': {str(value): float(count) for value, count in row.items()},
+             'proportions': {str(value): float(share) for value, share in shares.loc[label].items()},
+             'average': None if np.isnan(averages[label]) else round(float(averages[label]), 2)}
+            for label, row in counts.iterrows()]
+
+
+def json_response(body) -> tuple:
+    return 'application/json', json.dumps(body, indent=2).encode('utf-8')
+
+
+def render_figure(draw, extension: str, width: float = 6.4) -> tuple:
+    """
+    :param draw: function which draws on an Axes
+    :param extension: 'png' or 'svg'
+    :param width: in inches; matplotlib's default is 6.4
+    """
+    figure = Figure(figsize=(width, 4.8))
+    FigureCanvasAgg(figure)
+    draw(figure.add_subplot())
+    figure.tight_layout()
+    image = io.BytesIO()
+    figure.savefig(image, format=extension, transparent=True)
+    return {'png': 'image/png', 'svg': 'image/svg+xml'}[extension], image.getvalue()
+
+
+def handler(dashboard: Dashboard):
+    """
+    :return: a BaseHTTPRequestHandler class which serves `dashboard`
+    """
+
+    class DashboardRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                content_type, body = dashboard.render(url.path, tuple(sorted(parse_qsl(url.query))))
+                status = HTTPStatus.OK
+            except NotFound as e:
+                (content_type, body), status = json_response({'error': f'Not found: {e}'}), HTTPStatus.NOT_FOUND
+            except ValueError as e:
+                (content_type, body), status = json_response({'error': str(e)}), HTTPStatus.BAD_REQUEST
+            except Exception:
+                logging.exception('Error serving %s', self.path)
+                (content_type, body), status = json_response({'error': 'Internal error'}), HTTPStatus.INTERNAL_SERVER_ERROR
+
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return DashboardRequestHandler
+
+
+def main():
+    # ANALYSIS_FROM_SNAPSHOT reads the Parquet files written by snapshots.py instead of the database
+    eng = snapshot_engine() if load_optional_env_flag('ANALYSIS_FROM_SNAPSHOT') else get_engine(DATABASE_CONNECTION_STRING)
+    dashboard = Dashboard(eng, cache_size=int(load_optional_env_var('DASHBOARD_CACHE_SIZE', 256)))
+    eng.dispose()
+
+    port = int(load_optional_env_var('DASHBOARD_PORT', 8050))
+    # Requests are answered one at a time: they're quick, and matplotlib isn't thread safe
+    server = HTTPServer(('localhost', port), handler(dashboard))
+    print(f'Dashboard of {DATABASE_SCHEMA} at http://localhost:{port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
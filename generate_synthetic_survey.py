@@ -0,0 +1,172 @@
+"""
+Write a fake Survey Monkey export with the same layout as the real one, for testing and benchmarking 02_data_ingest.py
+without sharing any parent data.  The two header rows match what fix_questions() and validate_fixed_questions() expect.
+
+    python generate_synthetic_survey.py --rows 10000 --output synthetic_survey.csv
+"""
+import argparse
+import random
+from csv import writer as csv_writer
+from datetime import datetime, timedelta
+
+SUBMISSION_METHODS = [
+    'Each parent or guardian will submit a separate survey, and we will submit two surveys.',
+    'All parents and guardians will coordinate responses, and we will submit only one survey.',
+]
+
+# (answer to "in which grades are your children?", grade levels on that page, first column of that page)
+GRADE_COMBINATIONS = [
+    ('Grammar School only (K-6)', ['Grammar School'], 11),
+    ('Grammar and Middle School (K-6 and 7-8)', ['Grammar School', 'Middle School'], 22),
+    ('Grammar and High School (K-6 and 9-12)', ['Grammar School', 'High School'], 42),
+    ('Grammar, Middle, and High School (K-6, 7-8, and 9-12)', ['Grammar School', 'Middle School', 'High School'], 62),
+    ('Middle School only (7-8)', ['Middle School'], 91),
+    ('Middle and High School (7-8 and 9-12)', ['Middle School', 'High School'], 102),
+    ('High School only (9-12)', ['High School'], 122),
+]
+
+# Question text as Survey Monkey exports it (including the curly apostrophe fix_questions() corrects),
+# and the answers from best (4) to worst (1)
+RANK_QUESTIONS = [
+    ("How satisfied are you with the education that Golden View Classical Academy provided this year?",
+     ['Extremely Satisfied', 'Satisfied', 'Somewhat Satisfied', 'Not Satisfied']),
+    ("Given your children’s education level at the beginning of the year, how satisfied are you with their intellectual growth this year?",
+     ['Extremely Satisfied', 'Satisfied', 'Somewhat Satisfied', 'Not Satisfied']),
+    ("GVCA emphasizes 7 core virtues: Courage, Moderation, Justice, Responsibility, Prudence, Friendship, and Wonder. How well is the school culture reflected by these virtues?",
+     ['Strongly Reflected', 'Reflected', 'Somewhat Reflected', 'Not Reflected']),
+    ("How satisfied are you with your children's growth in moral character and civic virtue?",
+     ['Extremely Satisfied', 'Satisfied', 'Somewhat Satisfied', 'Not Satisfied']),
+    ("How effective is the communication between your family and your children's teachers?",
+     ['Extremely Effective', 'Effective', 'Somewhat Effective', 'Not Effective']),
+    ("How effective is the communication between your family and the school leadership?",
+     ['Extremely Effective', 'Effective', 'Somewhat Effective', 'Not Effective']),
+    ("How welcoming is the school community?",
+     ['Extremely Welcoming', 'Welcoming', 'Somewhat Welcoming', 'Not Welcoming']),
+]
+
+# The open response pages use the page title as the column header, and put the question in the sub header
+OPEN_RESPONSE_QUESTIONS = [
+    'What makes GVCA a good choice for you and your family?',
+    'Please provide us with examples of how GVCA can better serve you and your family.',
+]
+OPEN_RESPONSE_PAGE_TITLES = {
+    'Grammar School': 'Responses pertinent to Grammar School only',
+    'Middle School': 'Responses pertinent to Middle School only',
+    'High School': 'Responses pertinent to High School only',
+    'Whole School': 'Responses generic to the whole school.',
+}
+OPEN_RESPONSE_WORDS = ['teachers', 'curriculum', 'community', 'virtues', 'homework', 'communication', 'classical',
+                       'education', 'friendly', 'rigorous', 'events', 'leadership', 'reading', 'math', 'latin',
+                       'families', 'kind', 'challenging', 'music', 'art', 'sports', 'more', 'great', 'better']
+
+COLLECTOR_IDS = ['454577492', '454577519', '454577536']
+
+
+def build_header():
+    """
+    :return: (header row, sub header row), each with one entry per column of the export
+    """
+    header = ['Respondent ID', 'Collector ID', 'Start Date', 'End Date',
+              'IP Address', 'Email Address', 'First Name', 'Last Name', 'Custom Data 1',
+              'Choose a method of submission.', 'This academic year, in which grades are your children?']
+    sub_header = [''] * 9 + ['Response', 'Response']
+
+    for _, levels, first_column in GRADE_COMBINATIONS:
+        assert len(header) == first_column, f'Expected the {levels} page to start at column {first_column}, not {len(header)}'
+
+        # Matrix questions only have the question text in their first column.  Single-level pages aren't matrices.
+        for question_text, _ in RANK_QUESTIONS:
+            for i, level in enumerate(levels):
+                header.append(question_text if i == 0 else '')
+                sub_header.append(level if len(levels) > 1 else 'Response')
+
+        for question_text in OPEN_RESPONSE_QUESTIONS:
+            for level in levels + ['Whole School']:
+                header.append(OPEN_RESPONSE_PAGE_TITLES[level])
+                sub_header.append(question_text)
+
+    header += ['How many years have you had a child at GVCA?  The current academic year counts as 1.',
+               'Do you have one or more children on an IEP, 504, ALP, or READ Plan?',
+               'Do you consider yourself or any of your children part of a racial, ethnic, or cultural minority group?']
+    sub_header += ['Open-Ended Response', 'Response', 'Response']
+    return header, sub_header
+
+
+def build_row(rng, respondent_id, num_columns, grade_weights, rank_weights, answer_rate, open_response_rate):
+    """
+    One respondent's answers.  Only the page for their grade combination is filled in, like the real survey.
+
+    :param rng: random.Random
+    :param respondent_id: int
+    :param num_columns: length of the header
+    :param grade_weights: relative frequency of each entry in GRADE_COMBINATIONS
+    :param rank_weights: relative frequency of each rank answer, best to worst
+    :param answer_rate: chance each rank question is answered
+    :param open_response_rate: chance each open response question is answered
+    :return: list of str
+    """
+    row = [''] * num_columns
+    start = datetime(2024, 1, 4) + timedelta(seconds=rng.randrange(21 * 24 * 60 * 60))
+    row[0] = str(respondent_id)
+    row[1] = rng.choice(COLLECTOR_IDS)
+    row[2] = start.strftime('%m/%d/%Y %I:%M:%S %p')
+    row[3] = (start + timedelta(seconds=rng.randrange(60, 60 * 60))).strftime('%m/%d/%Y %I:%M:%S %p')
+    row[9] = rng.choice(SUBMISSION_METHODS)
+
+    grades, levels, column = rng.choices(GRADE_COMBINATIONS, weights=grade_weights)[0]
+    row[10] = grades
+    for _, answers in RANK_QUESTIONS:
+        for _ in levels:
+            if rng.random() < answer_rate:
+                row[column] = rng.choices(answers, weights=rank_weights)[0]
+            column += 1
+    for _ in OPEN_RESPONSE_QUESTIONS:
+        for _ in levels + ['Whole School']:
+            if rng.random() < open_response_rate:
+                row[column] = ' '.join(rng.choices(OPEN_RESPONSE_WORDS, k=rng.randint(3, 40))).capitalize() + '.'
+            column += 1
+
+    row[-3] = str(rng.randint(1, 12)) if rng.random() < answer_rate else ''
+    row[-2] = rng.choices(['Yes', 'No', ''], weights=[15, 80, 5])[0]
+    row[-1] = rng.choices(['Yes', 'No', ''], weights=[20, 70, 10])[0]
+    return row
+
+
+def generate_survey(output_filepath, num_rows, seed=0,
+                    grade_weights=(40, 10, 8, 12, 5, 10, 15), rank_weights=(45, 35, 15, 5),
+                    answer_rate=0.95, open_response_rate=0.3):
+    """
+    Write a synthetic export to `output_filepath`.  Rows are streamed out, so memory use doesn't depend on `num_rows`.
+
+    :return: None
+    """
+    rng = random.Random(seed)
+    header, sub_header = build_header()
+    with open(output_filepath, 'w', newline='') as f_out:
+        writer = csv_writer(f_out)
+        writer.writerow(header)
+        writer.writerow(sub_header)
+        for i in range(num_rows):
+            writer.writerow(build_row(rng, 118500000000 + i, len(header),
+                                      grade_weights, rank_weights, answer_rate, open_response_rate))
+
+
+def parse_weights(value):
+    return [float(weight) for weight in value.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000, help='number of respondents')
+    parser.add_argument('--output', default='synthetic_survey.csv', help='csv file to write')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--grade-weights', type=parse_weights, default=(40, 10, 8, 12, 5, 10, 15),
+                        help='relative frequency of each grade combination, in the order of question 2')
+    parser.add_argument('--rank-weights', type=parse_weights, default=(45, 35, 15, 5),
+                        help='relative frequency of each rank answer, best to worst')
+    parser.add_argument('--answer-rate', type=float, default=0.95, help='chance each rank question is answered')
+    parser.add_argument('--open-response-rate', type=float, default=0.3, help='chance each open response is answered')
+    args = parser.parse_args()
+
+    generate_survey(args.output, args.rows, args.seed, args.grade_weights, args.rank_weights,
+                    args.answer_rate, args.open_response_rate)
@@ -0,0 +1,246 @@
+"""
+Every rank question chart is a breakdown of the same numbers: the number of individuals (respondents weighted by
+num_individuals_in_response) giving each response value, for some slice of the respondents.
+RankCube computes all of those slices in one pass over `question_rank_responses JOIN respondents` using GROUPING SETS,
+and keeps the result in memory so each chart is a lookup instead of another scan of the tables.
+
+The slices are also stored in the `rank_response_aggregates` table, which refresh_rank_aggregates() rebuilds
+after every ingest (and 03_QA_Checks.sql after soft deletes), so loading the cube reads one row per slice
+instead of every response.
+
+    python rank_cube.py                     # add and fill rank_response_aggregates in DATABASE_SCHEMA, e.g. for a schema built before it existed
+    python rank_cube.py sac_survey_2023     # or in other schemas
+"""
+import argparse
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from utilities import bump_data_version, cached_read_sql, has_table, load_env_vars
+
+# Columns a chart can break responses out by
+DIMENSIONS = ('question_id', 'level', 'any_support', 'minority', 'first_year')
+
+# Each combination of DIMENSIONS the cube is computed for.  soft_delete and response_value are always included.
+GROUPING_SETS = [
+    (),
+    ('level',),
+    ('question_id',),
+    ('question_id', 'level'),
+    ('question_id', 'any_support'),
+    ('question_id', 'minority'),
+    ('question_id', 'first_year'),
+]
+
+RESPONSE_VALUES = [1, 2, 3, 4]
+
+CUBE_QUERY = """
+    WITH rank_rows AS
+             (
+                 SELECT question_id,
+                        CASE
+                            WHEN grammar THEN 'Grammar'
+                            WHEN middle THEN 'Middle'
+                            WHEN high THEN 'High'
+                            END    AS level,
+                        any_support,
+                        minority,
+                        tenure = 1 AS first_year,
+                        soft_delete,
+                        response_value,
+                        num_individuals_in_response
+                 FROM {schema_prefix}question_rank_responses
+                          JOIN
+                      {schema_prefix}respondents USING (respondent_id)
+             )
+    SELECT {dimensions},
+           soft_delete,
+           response_value,
+           GROUPING({dimensions}) AS grouping_id,
+           CAST(SUM(num_individuals_in_response) AS BIGINT) AS num_responses
+    FROM rank_rows
+    GROUP BY soft_delete, response_value, GROUPING SETS ({grouping_sets})
+    """
+
+AGGREGATES_TABLE = 'rank_response_aggregates'
+
+# Same as in 01_build_database.sql
+AGGREGATES_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS {schema_prefix}rank_response_aggregates
+    (
+        question_id    SMALLINT,
+        level          TEXT,
+        any_support    BOOLEAN,
+        minority       BOOLEAN,
+        first_year     BOOLEAN,
+        soft_delete    BOOLEAN,
+        response_value SMALLINT,
+        grouping_id    SMALLINT NOT NULL,
+        num_responses  BIGINT
+    );
+    """
+
+_, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
+
+
+def cube_query(database_schema: str = None) -> str:
+    return CUBE_QUERY.format(
+        schema_prefix=f'{database_schema}.' if database_schema else '',
+        dimensions=', '.join(DIMENSIONS),
+        grouping_sets=', '.join('(' + ', '.join(grouping_set) + ')' for grouping_set in GROUPING_SETS),
+    )
+
+
+def refresh_rank_aggregates(conn, database_schema: str = None) -> int:
+    """
+    Rebuild `rank_response_aggregates` from the responses.  Run inside the transaction which changed them,
+    so the aggregates are never out of step.  Schemas built before the table was introduced get it created.
+
+    :param conn: connection to database
+    :param database_schema: schema to refresh; defaults to the connection's current schema
+    :return: number of rows (slices) written
+    """
+    schema_prefix = f'{database_schema}.' if database_schema else ''
+    conn.execute(AGGREGATES_TABLE_DDL.format(schema_prefix=schema_prefix))
+    conn.execute(f'DELETE FROM {schema_prefix}{AGGREGATES_TABLE};')
+    num_rows = conn.execute(f"""INSERT INTO {schema_prefix}{AGGREGATES_TABLE}
+                                    ({', '.join(DIMENSIONS)}, soft_delete, response_value, grouping_id, num_responses)
+                                {cube_query(database_schema)};""").rowcount
+    if num_rows < 0:
+        # DuckDB doesn't report how many rows INSERT ... SELECT wrote
+        num_rows = conn.execute(f'SELECT COUNT(*) FROM {schema_prefix}{AGGREGATES_TABLE};').scalar()
+    return num_rows
+
+
+def grouping_id(grouped_dimensions: tuple) -> int:
+    """
+    The value GROUPING() gives rows of a grouping set: one bit per dimension, set when the dimension is rolled up.
+    The first dimension is the most significant bit.
+    """
+    return sum(1 << (len(DIMENSIONS) - 1 - i) for i, dimension in enumerate(DIMENSIONS) if dimension not in grouped_dimensions)
+
+
+class RankCube:
+    """
+    Weighted response counts for every grouping set in GROUPING_SETS, from one query.
+    """
+
+    def __init__(self, cells: pd.DataFrame):
+        """
+        :param cells: result of CUBE_QUERY
+        """
+        self.cells = cells
+
+    @classmethod
+    def load(cls, conn, database_schema: str = None):
+        """
+        Read the cube from `rank_response_aggregates`, or compute it from the responses if the schema doesn't have that table
+        (schemas built before it was added, and snapshots).
+
+        :param conn: connection to database
+        :param database_schema: schema to read; defaults to the connection's current schema
+        :return: RankCube
+        """
+        if has_table(conn, AGGREGATES_TABLE, database_schema):
+            schema_prefix = f'{database_schema}.' if database_schema else ''
+            query = f"SELECT {', '.join(DIMENSIONS)}, soft_delete, response_value, grouping_id, num_responses FROM {schema_prefix}{AGGREGATES_TABLE};"
+        else:
+            query = cube_query(database_schema)
+        return cls(cached_read_sql(conn, query, database_schema))
+
+    def question_ids(self) -> list:
+        question_ids = self.cells[self.cells.grouping_id == grouping_id(('question_id',))].question_id
+        return sorted(int(question_id) for question_id in question_ids.unique())
+
+    def counts(self, by: str = None, categories: dict = None, question_id: int = None, include_soft_deleted=True) -> pd.DataFrame:
+        """
+        Weighted number of responses for each response value, broken out by one dimension.
+
+        :param by: dimension to break out by; None for the total
+        :param categories: dict(value of `by`: label), in the order the rows should be returned.
+            None stands for respondents who didn't answer.  Values left out of the dict are left out of the result.
+        :param question_id: only count responses to this question
+        :param include_soft_deleted: set to False to leave out respondents removed by 03_QA_Checks.sql
+        :return: DataFrame with one row per label (or a single 'Total' row), and one column per response value.
+            Categories without any responses are filled in as 0.
+        """
+        grouped_dimensions = tuple(dimension for dimension in DIMENSIONS
+                                   if dimension == by or (dimension == 'question_id' and question_id is not None))
+        assert grouped_dimensions in GROUPING_SETS, f'The cube is not grouped by {grouped_dimensions}; add it to GROUPING_SETS'
+
+        cells = self.cells[self.cells.grouping_id == grouping_id(grouped_dimensions)]
+        if question_id is not None:
+            cells = cells[cells.question_id == question_id]
+        if not include_soft_deleted:
+            cells = cells[cells.soft_delete.eq(False)]  # like `WHERE NOT soft_delete`, which also leaves out NULLs
+
+        if by is None:
+            labels = pd.Series('Total', index=cells.index)
+            categories = {'Total': 'Total'}
+        else:
+            labels = cells[by].map(lambda value: categories.get(None if pd.isna(value) else value))
+        cells = cells.assign(label=labels).dropna(subset=['label'])
+
+        return (cells.groupby(['label', 'response_value']).num_responses.sum()
+                .unstack(fill_value=0)
+                .reindex(index=list(categories.values()), columns=RESPONSE_VALUES, fill_value=0))
+
+
+def average_score(counts: pd.Series) -> str:
+    """
+    Weighted average response value, to two decimal places, rounding halves up like Postgres' ROUND().
+
+    :param counts: one row of RankCube.counts()
+    :return: str, or '-' if there were no responses
+    """
+    total = int(counts.sum())
+    if total == 0:
+        return '-'
+    weighted_sum = sum(int(response_value) * int(num_responses) for response_value, num_responses in counts.items())
+    return str((Decimal(weighted_sum) / Decimal(total)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+def chart_inputs(counts: pd.DataFrame, intervals: pd.DataFrame = None) -> tuple:
+    """
+    Turn RankCube.counts() into the arguments create_stacked_bar_chart() expects.
+
+    :param counts: rows are the bars, in order
+    :param intervals: `average` from confidence_intervals.bootstrap_breakout(), to add to the labels of the bars
+        with the same label.  Bars which aren't in it are labelled as usual.
+    :return: (x_data_labels: ['<label>\\n(<average score>)', ...], or '<label>\\n(<average score>)\\n[<lower>, <upper>]' with intervals
+              proportions: DataFrame shaped like `counts`, with each row's share of responses for each response value)
+    """
+    x_data_labels = [f'{label}\n({average_score(row)})' for label, row in counts.iterrows()]
+    if intervals is not None:
+        x_data_labels = [f'{x_data_label}\n[{intervals.lower[label]:.2f}, {intervals.upper[label]:.2f}]'
+                         if label in intervals.index and pd.notna(intervals.lower[label]) else x_data_label
+                         for x_data_label, label in zip(x_data_labels, counts.index)]
+
+    totals = counts.sum(axis=1).to_numpy()[:, np.newaxis]
+    proportions = pd.DataFrame(np.divide(counts.to_numpy(), totals, out=np.zeros(counts.shape), where=totals > 0),
+                               index=counts.index, columns=counts.columns)
+    return x_data_labels, proportions
+
+
+def main(database_schemas: list, database_connection_string=DATABASE_CONNECTION_STRING) -> None:
+    """
+    Refresh the aggregates of each schema outside of an ingest, each in its own transaction, and bump its data version
+    so cached chart queries read them.
+    """
+    eng = create_engine(database_connection_string)
+    with eng.connect() as conn:
+        for database_schema in database_schemas:
+            with conn.begin():
+                num_rows = refresh_rank_aggregates(conn, database_schema)
+                bump_data_version(conn, database_schema)
+            print(f'{database_schema}: {num_rows} rows written to {AGGREGATES_TABLE}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database_schemas', nargs='*', default=[DATABASE_SCHEMA], help='schemas to refresh; defaults to DATABASE_SCHEMA')
+    args = parser.parse_args()
+
+    main(args.database_schemas)
@@ -0,0 +1,177 @@
+"""
+One file with every chart and word cloud, instead of hundreds of PNGs in folders under artifacts/.
+
+ReportWriter keeps one file open and writes each page as it's added, so a report of any size never holds more than one page
+in memory.  The format comes from the file's suffix:
+    .pdf     one chart or word cloud per page, through matplotlib's PdfPages
+    .html    a single page with every chart as inline SVG, and every word cloud as an embedded PNG; no other files needed
+
+    with ReportWriter('artifacts/report.pdf') as report:
+        report.add_chart(chart_spec)
+        report.add_image('Word cloud', 'artifacts/Open Response/....png')
+
+    python report.py    # REPORT_FILEPATH, default artifacts/report.pdf
+Run it after 04_Rank_Question_Charts.py and 05_open_response_analysis.py; it builds the same charts and word clouds,
+and charts and word clouds which haven't changed are read from their caches rather than queried or generated again.
+"""
+import base64
+import html
+import importlib
+import io
+from pathlib import Path
+
+import matplotlib.image
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+
+from snapshots import snapshot_engine
+from utilities import get_engine, load_env_vars, load_optional_env_flag, load_optional_env_var
+
+# The analysis scripts are named to sort in the order they're run, which `import` can't spell
+rank_question_charts = importlib.import_module('04_Rank_Question_Charts')
+open_response_analysis = importlib.import_module('05_open_response_analysis')
+
+_, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
+
+HTML_HEADER = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+    body {{ font-family: sans-serif; max-width: 60em; margin: auto; }}
+    section {{ page-break-after: always; margin-bottom: 3em; }}
+    svg, img {{ max-width: 100%; height: auto; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+"""
+HTML_FOOTER = """</body>
+</html>
+"""
+
+
+class ReportWriter:
+    """
+    Writes charts and images to one PDF or HTML file, a page at a time.  Every page is drawn on the same Figure,
+    which is cleared in between, like HeadlessChartRenderer in 04_Rank_Question_Charts.py.
+    """
+
+    def __init__(self, filepath, title: str = 'GVCA Survey Results'):
+        """
+        :param filepath: ending in .pdf or .html
+        :param title: of the document
+        """
+        self.filepath = Path(filepath)
+        self.format = self.filepath.suffix.lower().lstrip('.')
+        assert self.format in ('pdf', 'html'), f'Reports are written as .pdf or .html, not {self.filepath.name}'
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+        self.num_pages = 0
+        if self.format == 'pdf':
+            self.pdf = PdfPages(self.filepath, metadata={'Title': title})
+        else:
+            self.file = open(self.filepath, 'w', encoding='utf-8')
+            self.file.write(HTML_HEADER.format(title=html.escape(title)))
+
+    def add_chart(self, spec, heading: str = None) -> None:
+        """
+        :param spec: ChartSpec from 04_Rank_Question_Charts.py
+        :param heading: shown above the chart; defaults to the folder the chart is saved in, since many charts share a title
+        """
+        heading = heading or (spec.subfolder.name if spec.subfolder else None)
+        self.figure.clear()
+        ax = self.figure.add_subplot()
+        rank_question_charts.draw_stacked_bar_chart(ax, spec.title, spec.x_axis_label, spec.x_data_labels, spec.proportions, spec.styles)
+        self._write_figure(heading)
+
+    def add_image(self, title: str, image_filepath) -> None:
+        """
+        :param title: shown above the image
+        :param image_filepath: PNG, e.g. a word cloud
+        """
+        if self.format == 'pdf':
+            self.figure.clear()
+            ax = self.figure.add_subplot()
+            ax.imshow(matplotlib.image.imread(image_filepath))
+            ax.axis('off')
+            self._write_figure(title)
+        else:
+            encoded = base64.b64encode(Path(image_filepath).read_bytes()).decode('ascii')
+            self._write_section(title, f'<img alt="{html.escape(title)}" src="data:image/png;base64,{encoded}">')
+
+    def _write_figure(self, heading: str = None) -> None:
+        if self.format == 'pdf':
+            if heading:
+                self.figure.suptitle(heading, fontsize='small')
+            self.figure.tight_layout()
+            self.pdf.savefig(self.figure)
+            self.num_pages += 1
+        else:
+            self.figure.tight_layout()
+            svg = io.StringIO()
+            self.figure.savefig(svg, format='svg')
+            # Leave out the XML declaration and doctype, which don't belong inside HTML
+            svg = svg.getvalue()
+            self._write_section(heading, svg[svg.index('<svg'):])
+
+    def _write_section(self, heading: str, content: str) -> None:
+        heading = f'<h2>{html.escape(heading)}</h2>\n' if heading else ''
+        self.file.write(f'<section>\n{heading}{content}\n</section>\n')
+        self.num_pages += 1
+
+    def close(self) -> None:
+        """
+        Finish the file.
+        """
+        if self.format == 'pdf':
+            self.pdf.close()
+        else:
+            self.file.write(HTML_FOOTER)
+            self.file.close()
+        self.figure.clear()
+        print(f'Report: {self.num_pages} pages written to {self.filepath}')
+
+    def discard(self) -> None:
+        """
+        Close the file without finishing it, and delete it, so a failed run doesn't leave a report which looks complete.
+        """
+        if self.format == 'pdf':
+            # PdfPages can only close by finishing the document
+            self.pdf.close()
+        else:
+            self.file.close()
+        self.figure.clear()
+        self.filepath.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def main():
+    # ANALYSIS_FROM_SNAPSHOT reads the Parquet files written by snapshots.py instead of the database
+    eng = snapshot_engine() if load_optional_env_flag('ANALYSIS_FROM_SNAPSHOT') else get_engine(DATABASE_CONNECTION_STRING)
+
+    with ReportWriter(load_optional_env_var('REPORT_FILEPATH', 'artifacts/report.pdf')) as report:
+        # The same charts as 04_Rank_Question_Charts.py, from the same CHART_* settings, leaving its screening results alone
+        for spec in rank_question_charts.build_charts(eng, write_screening=False):
+            report.add_chart(spec)
+
+        with eng.connect() as conn:
+            conn.execute(f"SET SCHEMA '{DATABASE_SCHEMA}';")
+            for title, image_filepath in open_response_analysis.build_wordclouds(conn):
+                report.add_image(title, image_filepath)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Which breakouts of the rank questions show a real difference between groups, and which are noise?
+
+screen() tests every (question, breakout) table at once: the tables are stacked into one array, padded with empty groups,
+so each test is a handful of NumPy operations over all of them.  Two tests are run on each table:
+    * Pearson's chi-square test: do the groups' distributions of answers differ in any way?
+    * the linear-by-linear trend test (Cochran-Armitage, extended to more than two groups and answers):
+      do groups further along the breakout (e.g. Grammar -> Middle -> High, or year to year) answer higher or lower?
+Both tests of every table are corrected together, as one family, with the Benjamini-Hochberg false discovery rate, so
+marking a breakout significant when either test is keeps the false discovery rate at `fdr` rather than up to twice it.
+
+Counts are weighted by num_individuals_in_response, so each individual counts as one observation.  Individuals answering
+together aren't independent, so p-values are a little optimistic; see confidence_intervals.py for intervals which aren't.
+"""
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2
+
+
+def screen(tables: dict, fdr: float = 0.05) -> pd.DataFrame:
+    """
+    :param tables: dict((question_id, dimension): DataFrame with one row per group, in order, and one column per response value)
+    :param fdr: false discovery rate; breakouts with either q-value below it are marked `significant`
+    :return: DataFrame with one row per table, most significant first:
+        question_id, dimension, chi_square, df, p_chi_square, q_chi_square, trend_z, p_trend, q_trend,
+        average_spread (highest group average score minus the lowest), significant
+    """
+    keys = list(tables)
+    response_values = np.array(next(iter(tables.values())).columns, dtype=float)
+    observed = np.zeros((len(keys), max(len(table) for table in tables.values()), len(response_values)))
+    for i, table in enumerate(tables.values()):
+        observed[i, :len(table)] = table.to_numpy(dtype=float)
+
+    group_totals = observed.sum(axis=2)
+    value_totals = observed.sum(axis=1)
+    totals = group_totals.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Chi-square, leaving out groups and answers nobody gave
+        expected = group_totals[:, :, np.newaxis] * value_totals[:, np.newaxis, :] / totals[:, np.newaxis, np.newaxis]
+        chi_square = np.where(expected > 0, (observed - expected) ** 2 / expected, 0).sum(axis=(1, 2))
+        df = ((group_totals > 0).sum(axis=1) - 1) * ((value_totals > 0).sum(axis=1) - 1)
+        p_chi_square = np.where(df > 0, chi2.sf(chi_square, np.maximum(df, 1)), np.nan)
+
+        # Trend: (N - 1) * r^2, where r is the weighted correlation between group position and response value
+        group_scores = np.arange(observed.shape[1], dtype=float)
+        group_deviations = group_scores[np.newaxis, :] - (group_totals @ group_scores / totals)[:, np.newaxis]
+        value_deviations = response_values[np.newaxis, :] - (value_totals @ response_values / totals)[:, np.newaxis]
+        covariance = np.einsum('pgv,pg,pv->p', observed, group_deviations, value_deviations)
+        r = covariance / np.sqrt((group_totals * group_deviations ** 2).sum(axis=1) * (value_totals * value_deviations ** 2).sum(axis=1))
+        trend_z = np.sign(r) * np.sqrt((totals - 1) * r ** 2)
+        p_trend = chi2.sf(trend_z ** 2, 1)
+
+        group_averages = np.where(group_totals > 0, observed @ response_values / group_totals, np.nan)
+    average_spread = np.array([np.nanmax(row) - np.nanmin(row) if not np.isnan(row).all() else np.nan for row in group_averages])
+
+    # One correction over both tests of every table
+    q_chi_square, q_trend = np.split(benjamini_hochberg(np.concatenate([p_chi_square, p_trend])), 2)
+
+    results = pd.DataFrame({
+        'question_id': [question_id for question_id, _ in keys],
+        'dimension': [dimension for _, dimension in keys],
+        'chi_square': chi_square,
+        'df': df,
+        'p_chi_square': p_chi_square,
+        'q_chi_square': q_chi_square,
+        'trend_z': trend_z,
+        'p_trend': p_trend,
+        'q_trend': q_trend,
+        'average_spread': average_spread,
+    })
+    results['significant'] = (results.q_chi_square < fdr) | (results.q_trend < fdr)
+    results['_q'] = results[['q_chi_square', 'q_trend']].min(axis=1)
+    return results.sort_values(['_q', 'chi_square'], ascending=[True, False]).drop(columns='_q').reset_index(drop=True)
+
+
+def benjamini_hochberg(p_values: np.ndarray) -> np.ndarray:
+    """
+    q-values controlling the false discovery rate.  NaN p-values (tables which can't be tested) stay NaN, and aren't counted.
+    """
+    q_values = np.full(len(p_values), np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    if len(tested) == 0:
+        return q_values
+
+    order = tested[np.argsort(p_values[tested])]
+    ranked = p_values[order] * len(tested) / np.arange(1, len(tested) + 1)
+    # Each q-value is the smallest adjusted p-value at or below its rank
+    q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1)
+    return q_values
@@ -0,0 +1,116 @@
+"""
+Columnar (Parquet) snapshots of a survey schema, so analysis can run without a database connection.
+
+Each snapshot is written to its own folder, and never changed afterwards:
+    snapshots/<database_schema>/<version>/<tablename>.parquet
+    snapshots/<database_schema>/<version>/manifest.json
+    snapshots/<database_schema>/LATEST  (the version to read by default)
+
+snapshot_engine() returns an in-memory DuckDB engine with a view for each table, so the queries in
+04_Rank_Question_Charts.py and 05_open_response_analysis.py run against the files as they are,
+including the year over year queries which reference other schemas by name.
+DuckDB reads the Parquet files directly; nothing is copied into the database.
+read_snapshot() memory maps a single table into a DataFrame for notebook work.
+
+    python snapshots.py    # snapshot DATABASE_SCHEMA into SNAPSHOT_DIRECTORY (default: snapshots/)
+"""
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+from utilities import load_env_vars, load_optional_env_var
+
+_, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
+SNAPSHOT_DIRECTORY = load_optional_env_var('SNAPSHOT_DIRECTORY', 'snapshots')
+
+# Everything the analysis scripts and export_survey_data.sql read
+SNAPSHOT_TABLES = ['collectors', 'questions', 'question_response_mapping',
+                   'respondents', 'question_rank_responses', 'question_open_responses']
+
+
+def write_snapshot(conn, database_schema=DATABASE_SCHEMA, snapshot_directory=SNAPSHOT_DIRECTORY) -> Path:
+    """
+    Copy every table in SNAPSHOT_TABLES to Parquet, and make it the latest snapshot of the schema.
+
+    :param conn: connection to the database holding the survey data
+    :param database_schema: schema to snapshot
+    :param snapshot_directory: root folder for all snapshots
+    :return: folder the snapshot was written to
+    """
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    schema_directory = Path(snapshot_directory) / database_schema
+    version_directory = schema_directory / version
+    version_directory.mkdir(parents=True, exist_ok=False)
+
+    manifest = {'database_schema': database_schema, 'version': version, 'tables': {}}
+    for tablename in SNAPSHOT_TABLES:
+        # Nullable dtypes, so integer and boolean columns with NULLs keep their types in the file
+        table = pd.read_sql(con=conn, sql=f'SELECT * FROM {database_schema}.{tablename};').convert_dtypes()
+        table.to_parquet(version_directory / f'{tablename}.parquet', index=False)
+        manifest['tables'][tablename] = len(table)
+
+    with open(version_directory / 'manifest.json', 'w') as f_out:
+        json.dump(manifest, f_out, indent=2)
+    # Only point at the new version once it's complete
+    (schema_directory / 'LATEST').write_text(version)
+
+    print(f"Snapshot of {database_schema} written to {version_directory}: " +
+          ', '.join(f'{tablename} ({num_rows} rows)' for tablename, num_rows in manifest['tables'].items()))
+    return version_directory
+
+
+def find_snapshot(database_schema=DATABASE_SCHEMA, snapshot_directory=SNAPSHOT_DIRECTORY, version=None) -> Path:
+    """
+    :param version: a specific snapshot to read; defaults to the latest
+    :return: folder holding the snapshot's Parquet files
+    """
+    schema_directory = Path(snapshot_directory) / database_schema
+    version = version or (schema_directory / 'LATEST').read_text().strip()
+    return schema_directory / version
+
+
+def read_snapshot(tablename: str, database_schema=DATABASE_SCHEMA, snapshot_directory=SNAPSHOT_DIRECTORY, version=None) -> pd.DataFrame:
+    """
+    Load one table of a snapshot.  The file is memory mapped instead of read into a buffer.
+    """
+    return pd.read_parquet(find_snapshot(database_schema, snapshot_directory, version) / f'{tablename}.parquet', memory_map=True)
+
+
+def snapshot_engine(snapshot_directory=SNAPSHOT_DIRECTORY, versions=None):
+    """
+    An in-memory DuckDB engine with one schema per snapshotted survey, and a view over each table's Parquet file.
+    Use it anywhere a connection to the survey database is expected.
+
+    :param snapshot_directory: root folder for all snapshots
+    :param versions: dict(database_schema: version) to pin specific snapshots; others use their latest
+    :return: sqlalchemy Engine
+    """
+    versions = versions or {}
+    snapshots = {schema_directory.name: find_snapshot(schema_directory.name, snapshot_directory, versions.get(schema_directory.name))
+                 for schema_directory in sorted(Path(snapshot_directory).iterdir())
+                 if (schema_directory / 'LATEST').exists()}
+    assert snapshots, f'No snapshots found in {snapshot_directory}.  Run snapshots.py, or ingest with INGEST_SNAPSHOT=true'
+
+    # DuckDB engines for ':memory:' get a SingletonThreadPool, which shares one connection per thread and closes it from others,
+    # so utilities.run_concurrently() needs a QueuePool; each connection it opens gets its own views below
+    eng = create_engine('duckdb:///:memory:', poolclass=QueuePool)
+
+    @event.listens_for(eng, 'connect')
+    def create_views(dbapi_connection, connection_record):
+        # Every new connection gets its own in-memory database, so the views are created per connection
+        for database_schema, version_directory in snapshots.items():
+            dbapi_connection.execute(f'CREATE SCHEMA IF NOT EXISTS {database_schema};')
+            for parquet_filepath in version_directory.glob('*.parquet'):
+                dbapi_connection.execute(f"CREATE VIEW {database_schema}.{parquet_filepath.stem} AS "
+                                         f"SELECT * FROM read_parquet('{parquet_filepath.resolve()}');")
+
+    return eng
+
+
+if __name__ == '__main__':
+    with create_engine(DATABASE_CONNECTION_STRING).connect() as connection:
+        write_snapshot(connection)
@@ -0,0 +1,137 @@
+"""
+Compare any number of survey years.  Each year's survey is loaded into its own schema (sac_survey_2023, sac_survey_2024, ...),
+and each year is summarized by one RankCube: one set-based query per year, however many charts use it.
+
+Survey layouts have changed over the years (no Middle school before 2022-2023, Upper instead of High, no
+num_individuals_in_response in the first year), so each year is only summarized by question, from the columns the year
+over year comparison needs.  Schemas which don't have them are left out, with a warning.
+
+The years are loaded concurrently, each on its own connection; see utilities.run_concurrently().  A closed year rarely changes,
+so every year except the current DATABASE_SCHEMA is kept in `.cache/yoy/` after it's first loaded, keyed like
+utilities.QueryCache: by the query, the database, the schema, and its data version, if it has one.  Comparing against five
+prior years costs about the same as comparing against one.  If a prior year without a data version is ever reloaded,
+pass refresh_cache=True (YOY_REFRESH_CACHE=true in the .env file), or delete the folder.
+
+    yoy_cubes = load_yoy_cubes(eng)                        # every sac_survey_* schema
+    yoy_cubes = load_yoy_cubes(eng, ['sac_survey_2022', 'sac_survey_2024'])
+"""
+import json
+import logging
+from functools import partial
+from hashlib import sha256
+
+import pandas as pd
+
+from rank_cube import RankCube, grouping_id
+from utilities import cached_read_sql, data_version, get_cache_directory, load_env_vars, run_concurrently
+
+_, DATABASE_SCHEMA, DATABASE_CONNECTION_STRING = load_env_vars()
+
+SURVEY_SCHEMA_PREFIX = 'sac_survey_'
+
+# The RankCube grouping sets () and ('question_id',), with the same columns as rank_cube.CUBE_QUERY
+YEAR_QUERY = """
+    SELECT question_id,
+           CAST(NULL AS TEXT)    AS level,
+           CAST(NULL AS BOOLEAN) AS any_support,
+           CAST(NULL AS BOOLEAN) AS minority,
+           CAST(NULL AS BOOLEAN) AS first_year,
+           soft_delete,
+           response_value,
+           CASE GROUPING(question_id) WHEN 0 THEN {by_question} ELSE {total} END AS grouping_id,
+           CAST(SUM(num_individuals_in_response) AS BIGINT) AS num_responses
+    FROM {schema}.question_rank_responses
+             JOIN
+         {schema}.respondents USING (respondent_id)
+    GROUP BY soft_delete, response_value, GROUPING SETS ((question_id), ())
+    """
+
+# Every column YEAR_QUERY reads
+REQUIRED_COLUMNS = {
+    'question_rank_responses': ['respondent_id', 'question_id', 'response_value'],
+    'respondents': ['respondent_id', 'soft_delete', 'num_individuals_in_response'],
+}
+
+
+def discover_survey_schemas(conn, prefix=SURVEY_SCHEMA_PREFIX) -> list:
+    """
+    :return: every schema named like `sac_survey_<year>`, oldest first
+    """
+    schemas = conn.execute(f"""SELECT DISTINCT schema_name
+                               FROM information_schema.schemata
+                               WHERE schema_name LIKE '{prefix}%';""").scalars().all()
+    return sorted(schemas)
+
+
+def comparable_schemas(conn, database_schemas: list) -> list:
+    """
+    :return: the schemas which have every column in REQUIRED_COLUMNS.  The others are logged and left out.
+    """
+    comparable = []
+    for database_schema in database_schemas:
+        columns = {tuple(row) for row in conn.execute(f"""SELECT table_name, column_name
+                                                          FROM information_schema.columns
+                                                          WHERE table_schema = '{database_schema}';""")}
+        missing = [f'{tablename}.{column}' for tablename, table_columns in REQUIRED_COLUMNS.items()
+                   for column in table_columns if (tablename, column) not in columns]
+        if missing:
+            logging.warning('Leaving %s out of the year over year comparison; it has no %s', database_schema, ', '.join(missing))
+        else:
+            comparable.append(database_schema)
+    return comparable
+
+
+def year_label(database_schema: str, prefix=SURVEY_SCHEMA_PREFIX) -> str:
+    """
+    'sac_survey_2024' -> '2024'
+    """
+    return database_schema[len(prefix):] if database_schema.startswith(prefix) else database_schema
+
+
+def load_yoy_cubes(eng, database_schemas: list = None, current_schema=DATABASE_SCHEMA, max_workers: int = None, refresh_cache=False) -> dict:
+    """
+    :param eng: sqlalchemy engine; each year is read on its own connection
+    :param database_schemas: schemas to compare; defaults to every sac_survey_* schema.  See comparable_schemas()
+    :param current_schema: the year still being worked on, which is never cached in `.cache/yoy/`
+    :param max_workers: number of years to load at once; defaults to all of them
+    :param refresh_cache: read every year from the database, and replace what's cached
+    :return: dict(year label: RankCube), oldest first
+    """
+    with eng.connect() as conn:
+        database_schemas = comparable_schemas(conn, database_schemas or discover_survey_schemas(conn))
+    return run_concurrently(eng, yoy_queries(database_schemas, current_schema, refresh_cache), max_workers)
+
+
+def yoy_queries(database_schemas: list, current_schema=DATABASE_SCHEMA, refresh_cache=False) -> dict:
+    """
+    The query for each year, to run alongside other queries with utilities.run_concurrently().  See load_yoy_cubes()
+
+    :param database_schemas: from comparable_schemas()
+    :return: dict(year label: function which takes a connection and returns the year's RankCube)
+    """
+    return {year_label(database_schema): partial(load_year, database_schema=database_schema,
+                                                 cache=database_schema != current_schema, refresh_cache=refresh_cache)
+            for database_schema in database_schemas}
+
+
+def load_year(conn, database_schema: str, cache=True, refresh_cache=False) -> RankCube:
+    """
+    One year's RankCube, by question, from the cache if it's there.
+
+    :param cache: read from, and write to, `.cache/yoy/`.  Otherwise the year is read through utilities.cached_read_sql()
+    :param refresh_cache: read from the database even if the year is cached, and replace it
+    """
+    query = YEAR_QUERY.format(schema=database_schema, by_question=grouping_id(('question_id',)), total=grouping_id(()))
+    if not cache:
+        return RankCube(cached_read_sql(conn, query, database_schema))
+
+    # Schemas from before data_version are keyed by where they are, so a different database with the same schema names misses
+    version = data_version(conn, database_schema) or (str(conn.engine.url), database_schema)
+    key = sha256(json.dumps([' '.join(query.split()), *version], default=str).encode()).hexdigest()
+    cache_filepath = get_cache_directory('yoy') / f'{database_schema}-{key}.parquet'
+    if not refresh_cache and cache_filepath.exists():
+        return RankCube(pd.read_parquet(cache_filepath))
+
+    cells = pd.read_sql(con=conn, sql=query)
+    cells.to_parquet(cache_filepath, index=False)
+    return RankCube(cells)